@@ -0,0 +1,72 @@
+import os
+import mmap
+import hashlib
+
+
+class BlobStore:
+    """
+    Content-addressed, append-only pack file for encoded images.
+    Identical blobs are stored once; the key -> (offset, length) index lives in
+    the `blobs` table of the owning sqlite connection, so it commits together
+    with the rows referencing it.
+    """
+    def __init__(self, path, connection):
+        self.path = path
+        self.db = connection
+
+        cursor = self.db.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, offset INTEGER, length INTEGER)")
+        self.db.commit()
+
+        self.file = open(path, 'ab')
+        self.read_file = open(path, 'rb')
+        self._mmap = None
+        self._unsynced = False
+
+    @staticmethod
+    def key_of(data):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def put(self, data):
+        key = self.key_of(data)
+        cursor = self.db.cursor()
+        cursor.execute("SELECT 1 FROM blobs WHERE key = ?", (key,))
+        if cursor.fetchone() is not None:
+            return key
+
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        self._unsynced = True
+        cursor.execute("INSERT INTO blobs (key, offset, length) VALUES (?, ?, ?)", (key, offset, len(data)))
+        return key
+
+    def get(self, key):
+        """Zero-copy memoryview of the blob, or None if the key is unknown."""
+        cursor = self.db.cursor()
+        cursor.execute("SELECT offset, length FROM blobs WHERE key = ?", (key,))
+        record = cursor.fetchone()
+        if record is None:
+            return None
+        return self.view(*record)
+
+    def view(self, offset, length):
+        if self._mmap is None or offset + length > len(self._mmap):
+            # the pack only grows, remap to cover the new tail; views of the
+            # old map stay valid until they are released
+            self.file.flush()
+            self._mmap = mmap.mmap(self.read_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[offset:offset + length]
+
+    def sync(self):
+        # called before the db commits so committed refs never point past the durable end of the pack
+        if self._unsynced:
+            os.fsync(self.file.fileno())
+            self._unsynced = False
+
+    def close(self):
+        self.sync()
+        self.file.close()
+        self._mmap = None
+        self.read_file.close()
@@ -19,12 +19,24 @@ class BottomUpAgent:
     def __init__(self, config):
         self.game_name = config['game_name']
 
+        self.start_time = time.time()
+        startup_times = {}
+        time0 = time.time()
         self.logger = Logger(config['project_name'], config['game_name'] + ' - ' + config['run_name'], backend='wandb')
+        startup_times['logger'] = time.time() - time0
+        time0 = time.time()
         self.eye = Eye(config)
         self.hand = Hand(config)
+        startup_times['eye/hand'] = time.time() - time0
+        time0 = time.time()
         self.detector = Detector(config)
+        startup_times['detector'] = time.time() - time0
+        time0 = time.time()
         self.teacher = Teacher(config)
+        startup_times['teacher'] = time.time() - time0
+        time0 = time.time()
         self.brain = Brain(config, self.detector, self.logger)
+        startup_times['brain'] = time.time() - time0
         self.close_explore = config['close_explore']
         self.close_evaluate = config['close_evaluate'] if 'close_evaluate' in config else False
         self.close_reset = config['close_reset'] if 'close_reset' in config else True
@@ -36,6 +48,17 @@ class BottomUpAgent:
 
         self.suspended_skill_cluster_ids = []
 
+        # clip is needed by the first observation; segmenters only when objects are detected
+        detector_config = config['detector']
+        if 'prewarm' in detector_config:
+            prewarm = detector_config['prewarm']
+        else:
+            prewarm = ['clip'] if self.is_base else ['clip'] + self.detector.backend_models()
+        self.detector.prewarm(prewarm)
+
+        print("Startup times: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_times.items()) +
+              f", total {sum(startup_times.values()):.2f}s (prewarming: {', '.join(prewarm) or 'none'})")
+
         print(f"GameAgent initialized")
         print(f"game_name: {self.game_name}")
 
@@ -82,6 +105,28 @@ class BottomUpAgent:
     
 
     def run_step(self, step, task):
+        # one commit per step instead of one per LongMemory write
+        long_memory = self.brain.long_memory
+        commit_count, commit_time = long_memory.commit_count, long_memory.commit_time
+        with long_memory.transaction():
+            result = self._run_step(step, task)
+        # barrier: everything the step wrote is on disk before the next step starts
+        long_memory.flush()
+        object_image_cache = long_memory.object_image_cache.stats()
+        self.logger.log({"long_memory/commits": long_memory.commit_count - commit_count,
+                         "long_memory/commit_ms": (long_memory.commit_time - commit_time) * 1000,
+                         "long_memory/object_image_cache_hit_rate": object_image_cache['hit_rate'],
+                         "long_memory/object_image_cache_bytes": object_image_cache['bytes']}, step)
+        detector_cache = self.detector.get_cache_stats()
+        if 'detections' in detector_cache:
+            self.logger.log({"detector/cache_hit_rate": detector_cache['detections']['hit_rate'],
+                             "detector/cache_misses": detector_cache['detections']['misses']}, step)
+        if 'embeddings' in detector_cache:
+            self.logger.log({"detector/embedding_cache_hit_rate": detector_cache['embeddings']['hit_rate']}, step)
+        self.logger.log({"detector/debug_images_dropped": detector_cache['debug_sink']['dropped']}, step)
+        return result
+
+    def _run_step(self, step, task):
         self.logger.log({"step": step}, step)
         # get screen 
         ob = self.get_observation()
@@ -97,6 +142,7 @@ class BottomUpAgent:
                 'object_ids': [],
                 'mcts': mcts,
                 'skill_clusters': [],
+                'image': ob['screen'],
             }
             state['id'] = self.brain.long_memory.save_state(state)
             
@@ -166,9 +212,12 @@ class BottomUpAgent:
             time.sleep(self.exec_duration)
             obs.append(self.get_observation())
 
+        # detection runs in the worker pool (if configured) while the memory reads below proceed
+        objects_future = self.detector.extract_objects_async(obs[-1]['screen'])
         existed_object_ids = state['object_ids']
         existed_objects = self.brain.long_memory.get_object_by_ids(existed_object_ids)
-        updated_objects = self.detector.update_objects(obs[-1]['screen'], existed_objects)
+        existed_children_operations = state['mcts'].get_children_operations(node)
+        updated_objects = self.detector.update_objects(obs[-1]['screen'], existed_objects, objects_future)
         print(f"detectced objects nums: {len(updated_objects)}")
         updated_objects = self.brain.long_memory.update_objects(state, updated_objects)
 
@@ -181,7 +230,6 @@ class BottomUpAgent:
             return None, False
 
         candidate_operations = []
-        existed_children_operations = state['mcts'].get_children_operations(node)    
         for operation in potential_operations:
             existed_flag = False   
             for existed_operation in existed_children_operations:
@@ -388,6 +436,8 @@ class BottomUpAgent:
         should_exit = False
 
         self.get_observation()
+        print(f"First observation {time.time() - self.start_time:.2f}s after startup, model load times: " +
+              ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.detector.get_load_times().items()))
 
         def toggle_pause():
             nonlocal is_paused
@@ -431,34 +481,39 @@ class BottomUpAgent:
 
         finished = False
         step = self.logger.last_value('step') + 1  if self.logger.last_value('step') is not None else 0
-        while not finished and not should_exit:
-            if is_paused and not step_requested:
-                time.sleep(0.1)
-                continue
+        try:
+            while not finished and not should_exit:
+                if is_paused and not step_requested:
+                    time.sleep(0.1)
+                    continue
 
-            print(f"Running step: {step}")
-            self.logger.log({"step": step}, step)
+                print(f"Running step: {step}")
+                self.logger.log({"step": step}, step)
 
-            if step > max_step:
-                break
+                if step > max_step:
+                    break
 
-            if self.is_base:
-                result = self.run_step_base(task, step)
-            else:
-                result = self.run_step(step, task)
+                if self.is_base:
+                    result = self.run_step_base(task, step)
+                else:
+                    result = self.run_step(step, task)
 
-            if result == 'Finished':
-                finished = True
+                if result == 'Finished':
+                    finished = True
 
-            if step_requested:
-                step_requested = False
-                is_paused = True  # Always pause after step execution
+                if step_requested:
+                    step_requested = False
+                    is_paused = True  # Always pause after step execution
 
-            if not is_continuous:
-                is_paused = True  # Always pause if not in continuous mode
+                if not is_continuous:
+                    is_paused = True  # Always pause if not in continuous mode
 
-            time.sleep(0.1)  # Small delay between steps
-            step += 1
+                time.sleep(0.1)  # Small delay between steps
+                step += 1
+        finally:
+            # flushes pending write-behind work and saves the index sidecars
+            self.brain.long_memory.close()
+            self.detector.close()
 
     def state_reset(self):
         if self.close_reset:
@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used map with hit-rate and byte-usage counters.
+    Values are sized with `sizeof` (ndarray.nbytes by default) against max_bytes.
+    """
+    def __init__(self, max_bytes=None, max_items=None, sizeof=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.sizeof = sizeof or (lambda value: getattr(value, 'nbytes', 0))
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.bytes -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.bytes += size
+            while (self.max_bytes is not None and self.bytes > self.max_bytes) or \
+                  (self.max_items is not None and len(self.items) > self.max_items):
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            if key in self.items:
+                value, size = self.items.pop(key)
+                self.bytes -= size
+                return value
+            return None
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "items": len(self.items),
+            "bytes": self.bytes,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,132 @@
+import os
+import glob
+import queue
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+import cv2
+
+
+class DebugSink:
+    """
+    Writes detection overlays for debugging. Callers only enqueue the frame and boxes;
+    drawing, colour conversion and encoding happen on a background thread.
+    mode: 'async' (background writer), 'sync' (write inline) or 'off' (no-op).
+    Every 1/sample_rate-th frame is kept, frames are dropped when the queue is full,
+    and the oldest files are deleted beyond max_files or max_mb.
+    """
+    def __init__(self, output_dir="../images", mode='async', sample_rate=1.0, max_files=500, max_mb=None,
+                 format='png', jpeg_quality=85, png_compression=1, queue_size=8):
+        self.output_dir = output_dir
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb is not None else None
+        self.format = format
+        if format == 'jpg':
+            self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        elif format == 'png':
+            self.encode_params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        else:
+            raise ValueError(f"Unsupported debug image format: {format}")
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.queue = None
+        self.writer = None
+        self.files = deque()
+        self.total_bytes = 0
+        if self.mode == 'off':
+            return
+
+        os.makedirs(output_dir, exist_ok=True)
+        # files of earlier runs count towards max_files too
+        existed = glob.glob(os.path.join(output_dir, 'detection_*.*'))
+        self.files = deque((path, os.path.getsize(path)) for path in sorted(existed, key=os.path.getmtime))
+        self.total_bytes = sum(size for _, size in self.files)
+        self.rotate()
+
+        if self.mode == 'async':
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.writer = threading.Thread(target=self.writer_loop, name='debug-sink', daemon=True)
+            self.writer.start()
+
+    def sampled(self):
+        # deterministic sampling: keeps exactly sample_rate of the submitted frames
+        self.submitted += 1
+        return int(self.submitted * self.sample_rate) > int((self.submitted - 1) * self.sample_rate)
+
+    def submit(self, image, objects, tag='detection'):
+        if self.mode == 'off' or not self.sampled():
+            return
+        boxes = [list(obj['bbox']) for obj in objects]
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        if self.mode == 'sync':
+            self.write(image, boxes, tag, timestamp)
+            return
+        try:
+            self.queue.put_nowait((image, boxes, tag, timestamp))
+        except queue.Full:
+            self.dropped += 1
+
+    def writer_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                self.write(*item)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def write(self, image, boxes, tag, timestamp):
+        image_with_boxes = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        for idx, (x0, y0, w, h) in enumerate(boxes):
+            x0, y0, x1, y1 = int(x0), int(y0), int(x0 + w), int(y0 + h)
+            cv2.rectangle(image_with_boxes, (x0, y0), (x1, y1), (255, 0, 0), 2)
+            cv2.putText(image_with_boxes, str(idx), (x0, y0 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+        filepath = os.path.join(self.output_dir, f"{tag}_{timestamp}.{self.format}")
+        if not cv2.imwrite(filepath, image_with_boxes, self.encode_params):
+            print(f"Failed to write {filepath}")
+            return
+        self.written += 1
+        size = os.path.getsize(filepath)
+        self.files.append((filepath, size))
+        self.total_bytes += size
+        self.rotate()
+
+    def over_cap(self):
+        if self.max_files is not None and len(self.files) > self.max_files:
+            return True
+        return self.max_bytes is not None and len(self.files) > 1 and self.total_bytes > self.max_bytes
+
+    def rotate(self):
+        while self.over_cap():
+            path, size = self.files.popleft()
+            self.total_bytes -= size
+            if os.path.exists(path):
+                os.remove(path)
+
+    def flush(self):
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "files": len(self.files),
+            "mb": self.total_bytes / 1024 / 1024,
+        }
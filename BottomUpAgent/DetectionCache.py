@@ -0,0 +1,171 @@
+import os
+import json
+import hashlib
+import numpy as np
+import cv2
+from .Cache import LRUCache
+from .ImageHash import POPCOUNT8, average_hash
+
+
+class DetectionCache:
+    """
+    Detector output keyed by a perceptual hash of the downsampled frame and the
+    detection settings (Detector.detection_settings()). Entries live in an in-memory LRU and as one .npz per frame
+    under cache_dir; the in-memory LRU is bounded by max_items and max_memory_mb, and the
+    oldest files are evicted once the directory exceeds max_disk_mb.
+    Lookups take the nearest stored frame hash within max_distance bits, and a hit
+    is only served when its thumbnail is within `tolerance` mean absolute
+    difference of the new frame. Stored crops are only served on an identical
+    thumbnail; a near hit keeps the boxes and re-crops and re-hashes them from the new frame.
+    """
+    def __init__(self, cache_dir, settings, max_items=256, max_memory_mb=128, max_disk_mb=512, tolerance=2.0, max_distance=16):
+        self.cache_dir = cache_dir
+        self.config_key = hashlib.blake2b(json.dumps(settings, sort_keys=True, default=str).encode(), digest_size=4).hexdigest()
+        self.memory = LRUCache(max_bytes=max_memory_mb * 1024 * 1024, max_items=max_items,
+                               sizeof=lambda entry: entry[0].nbytes + sum(obj['image'].nbytes for obj in entry[1]))
+        self.max_disk_bytes = max_disk_mb * 1024 * 1024
+        self.tolerance = tolerance
+        self.max_distance = max_distance
+        # frame hash bits of every known entry, memory and disk
+        self.keys = {}
+        self.hits = 0
+        self.near_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(self.config_key + '_') and name.endswith('.npz'):
+                    self.add_key(name[:-len('.npz')])
+
+    @staticmethod
+    def thumbnail(image):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+
+    def key(self, thumb):
+        # 16x16 average hash of the thumbnail, prefixed with the detection settings
+        small = cv2.resize(thumb, (16, 16), interpolation=cv2.INTER_AREA)
+        bits = np.packbits(small > small.mean())
+        return f"{self.config_key}_{bits.tobytes().hex()}"
+
+    def add_key(self, key):
+        self.keys[key] = np.frombuffer(bytes.fromhex(key.split('_')[1]), dtype=np.uint8)
+
+    def candidates(self, key):
+        # stored keys ordered by Hamming distance, up to max_distance
+        if len(self.keys) == 0:
+            return []
+        names = list(self.keys.keys())
+        bits = np.stack([self.keys[name] for name in names])
+        query = np.frombuffer(bytes.fromhex(key.split('_')[1]), dtype=np.uint8)
+        distances = POPCOUNT8[np.bitwise_xor(bits, query)].sum(axis=1)
+        order = np.argsort(distances, kind='stable')
+        return [names[i] for i in order if distances[i] <= self.max_distance]
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, image):
+        """Return a fresh copy of the cached objects for this frame, or None."""
+        thumb = self.thumbnail(image)
+        for key in self.candidates(self.key(thumb)):
+            entry = self.memory.get(key)
+            if entry is None and self.cache_dir is not None and os.path.exists(self.path(key)):
+                try:
+                    entry = self.load(key)
+                    self.memory.put(key, entry)
+                    self.disk_hits += 1
+                    os.utime(self.path(key))
+                except Exception as e:
+                    print(f"Failed to load detection cache entry {key}: {e}")
+            if entry is None:
+                # evicted from both memory and disk
+                self.keys.pop(key, None)
+                continue
+            difference = np.mean(cv2.absdiff(entry[0], thumb))
+            if difference <= self.tolerance:
+                self.hits += 1
+                if difference == 0:
+                    return [dict(obj, center=tuple(obj['center']), bbox=list(obj['bbox'])) for obj in entry[1]]
+                # small changes (e.g. a card's number) are under the tolerance, the crops must be current
+                self.near_hits += 1
+                objects = [self.recrop(image, obj) for obj in entry[1]]
+                return [obj for obj in objects if obj is not None]
+
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def recrop(image, obj):
+        # the stored crop has the exact size make_object cut, bbox w/h may be fractional
+        x0, y0 = int(obj['bbox'][0]), int(obj['bbox'][1])
+        height, width = obj['image'].shape[:2]
+        cropped = image[y0:y0 + height, x0:x0 + width]
+        if cropped.shape[:2] != (height, width):
+            return None
+        return dict(obj, center=tuple(obj['center']), bbox=list(obj['bbox']), image=cropped,
+                    hash=average_hash(cv2.resize(cropped, (32, 32))))
+
+    def put(self, image, objects):
+        thumb = self.thumbnail(image)
+        key = self.key(thumb)
+        objects = [{k: v for k, v in obj.items() if k != 'id'} for obj in objects]
+        for obj in objects:
+            obj['id'] = None
+            # crops are views into the screenshot, a copy keeps the entry from pinning the whole frame
+            obj['image'] = np.ascontiguousarray(obj['image']).copy()
+        self.memory.put(key, (thumb, objects))
+        self.add_key(key)
+        if self.cache_dir is not None:
+            self.save(key, thumb, objects)
+            self.evict()
+
+    def save(self, key, thumb, objects):
+        crops = {f"crop_{i}": obj['image'] for i, obj in enumerate(objects)}
+        np.savez(self.path(key), thumb=thumb,
+                 bboxes=np.array([obj['bbox'] for obj in objects], dtype=np.float64).reshape(-1, 4),
+                 areas=np.array([obj['area'] for obj in objects], dtype=np.float64),
+                 hashes=np.array([obj['hash'] for obj in objects], dtype=np.uint64),
+                 centers=np.array([obj['center'] for obj in objects], dtype=np.int64).reshape(-1, 2),
+                 **crops)
+
+    def load(self, key):
+        data = np.load(self.path(key))
+        objects = []
+        for i in range(len(data['areas'])):
+            bbox = [int(v) if float(v).is_integer() else float(v) for v in data['bboxes'][i]]
+            area = float(data['areas'][i])
+            objects.append({
+                'id': None,
+                'bbox': bbox,
+                'area': int(area) if area.is_integer() else area,
+                'hash': int(data['hashes'][i]),
+                'center': tuple(int(v) for v in data['centers'][i]),
+                'image': data[f"crop_{i}"],
+            })
+        return data['thumb'], objects
+
+    def evict(self):
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.npz')]
+        stats = [(os.path.getmtime(path), os.path.getsize(path), path) for path in files]
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.disk_evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "memory_items": len(self.memory),
+            "disk_evictions": self.disk_evictions,
+        }
@@ -0,0 +1,217 @@
+import copy
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+from concurrent.futures import Future
+import numpy as np
+
+
+def worker_config(config):
+    # the main process keeps the caches and writes the overlays, workers only detect
+    config = copy.deepcopy(config)
+    detector_config = config['detector']
+    detector_config['cache'] = {'enabled': False}
+    detector_config['embedding_cache'] = {'enabled': False}
+    detector_config['debug_sink'] = {'mode': 'off'}
+    detector_config['workers'] = {'enabled': False}
+    return config
+
+def build_detector(config):
+    from .Detector import Detector
+    detector = Detector(worker_config(config))
+    for name in detector.backend_models():
+        detector.models[name].get()
+    return detector
+
+def worker_main(config, requests, results):
+    """Detection process: frames arrive as shared memory blocks, object lists go back on results."""
+    detector = build_detector(config)
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        job_id, shm_name, shape, dtype = item
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                # copied, the block is unlinked once the result is back and the frame is kept for incremental detection
+                image = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+            objects = detector.detect_frame(image)
+            detector.last_frame, detector.last_objects = image, objects
+            results.send((job_id, objects, None))
+        except Exception:
+            results.send((job_id, None, traceback.format_exc()))
+
+
+class DetectionWorkerPool:
+    """
+    Detection processes that keep their models loaded. submit() copies the frame into a
+    shared memory block and returns a Future of its object list. A collector thread
+    resolves the futures and restarts workers that died; their in-flight frames are
+    resubmitted up to max_retries times before the futures fail. After max_restarts the
+    pool is marked broken and submit() raises. Every worker sends its results on its own
+    pipe, which is dropped with the worker, so terminating one cannot corrupt another's.
+    """
+    worker_target = staticmethod(worker_main)
+
+    def __init__(self, config, num_workers=1, max_retries=1, max_restarts=10, start_method='spawn'):
+        self.config = config
+        self.max_retries = max_retries
+        self.max_restarts = max_restarts
+        self.context = mp.get_context(start_method)
+        self.lock = threading.Lock()
+        self.jobs = {}           # job_id -> dict(future, shm, shape, dtype, worker, attempts)
+        self.free_blocks = []    # shared memory blocks of finished jobs, reused by submit
+        self.next_job_id = 0
+        self.restarts = 0
+        self.closed = False
+        self.broken = False
+
+        self.workers = [None] * num_workers
+        self.requests = [None] * num_workers
+        self.results = [None] * num_workers
+        for i in range(num_workers):
+            self.start_worker(i)
+        self.collector = threading.Thread(target=self.collector_loop, name='detection-collector', daemon=True)
+        self.collector.start()
+
+    def start_worker(self, i):
+        # a replaced worker's pipe may hold a partial message, it is closed rather than read
+        if self.results[i] is not None:
+            self.results[i].close()
+        self.requests[i] = self.context.Queue()
+        self.results[i], sender = self.context.Pipe(duplex=False)
+        self.workers[i] = self.context.Process(target=self.worker_target, args=(self.config, self.requests[i], sender),
+                                               name=f'detection-worker-{i}', daemon=True)
+        self.workers[i].start()
+        # the worker holds the only send end, so its exit shows up as EOF
+        sender.close()
+
+    def pending(self, i):
+        return sum(1 for job in self.jobs.values() if job['worker'] == i)
+
+    def submit(self, image: np.ndarray) -> Future:
+        future = Future()
+        image = np.ascontiguousarray(image)
+        with self.lock:
+            if self.closed or self.broken:
+                raise RuntimeError("DetectionWorkerPool is " + ("closed" if self.closed else "broken"))
+            shm = self.acquire(image.nbytes)
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+            job_id = self.next_job_id
+            self.next_job_id += 1
+            i = min(range(len(self.workers)), key=self.pending)
+            self.jobs[job_id] = {'future': future, 'shm': shm, 'shape': image.shape, 'dtype': image.dtype.str,
+                                 'worker': i, 'attempts': 0}
+            self.request(job_id)
+        return future
+
+    def request(self, job_id):
+        job = self.jobs[job_id]
+        self.requests[job['worker']].put((job_id, job['shm'].name, job['shape'], job['dtype']))
+
+    def acquire(self, nbytes):
+        for i, shm in enumerate(self.free_blocks):
+            if shm.size >= nbytes:
+                return self.free_blocks.pop(i)
+        return shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+
+    def release(self, job):
+        with self.lock:
+            self.free_blocks.append(job['shm'])
+
+    def unlink_blocks(self):
+        for shm in self.free_blocks:
+            shm.close()
+            shm.unlink()
+        self.free_blocks = []
+
+    def collector_loop(self):
+        # the pipes are only replaced on this thread, by check_workers
+        while not self.closed:
+            for connection in wait([results for results in self.results if not results.closed], timeout=0.5):
+                try:
+                    job_id, objects, error = connection.recv()
+                except (EOFError, OSError):
+                    # the worker exited, check_workers restarts it
+                    connection.close()
+                    continue
+                with self.lock:
+                    job = self.jobs.pop(job_id, None)
+                if job is not None:
+                    self.release(job)
+                    if error is None:
+                        job['future'].set_result(objects)
+                    else:
+                        job['future'].set_exception(RuntimeError(f"Detection worker failed:\n{error}"))
+            self.check_workers()
+
+    def check_workers(self):
+        failed = []
+        with self.lock:
+            for i, worker in enumerate(self.workers):
+                if self.closed or self.broken or worker.is_alive():
+                    continue
+                if self.restarts >= self.max_restarts:
+                    print(f"Detection worker {i} exited with code {worker.exitcode}, {self.restarts} restarts already, giving up")
+                    self.broken = True
+                    failed += list(self.jobs.values())
+                    self.jobs = {}
+                    break
+                print(f"Detection worker {i} exited with code {worker.exitcode}, restarting")
+                self.restarts += 1
+                self.start_worker(i)
+                for job_id, job in list(self.jobs.items()):
+                    if job['worker'] != i:
+                        continue
+                    job['attempts'] += 1
+                    if job['attempts'] > self.max_retries:
+                        failed.append(self.jobs.pop(job_id))
+                    else:
+                        self.request(job_id)
+        for job in failed:
+            self.release(job)
+            job['future'].set_exception(RuntimeError("Detection worker crashed on this frame"))
+
+    def abandon(self, future, timeout=5.0):
+        """
+        Give up on a pending future: its worker is terminated (check_workers restarts it and
+        resubmits its other frames) and the future is cancelled. False if it already finished.
+        """
+        with self.lock:
+            job_id = next((job_id for job_id, job in self.jobs.items() if job['future'] is future), None)
+            if job_id is None:
+                return False
+            job = self.jobs.pop(job_id)
+            worker = self.workers[job['worker']]
+        worker.terminate()
+        worker.join(timeout)
+        self.release(job)
+        future.cancel()
+        return True
+
+    def stats(self):
+        return {"workers": len(self.workers), "pending": len(self.jobs), "restarts": self.restarts, "broken": self.broken}
+
+    def close(self, timeout=5.0):
+        with self.lock:
+            self.closed = True
+            for requests in self.requests:
+                requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.collector.join()
+        for results in self.results:
+            results.close()
+        with self.lock:
+            jobs, self.jobs = list(self.jobs.values()), {}
+            self.free_blocks += [job['shm'] for job in jobs]
+            self.unlink_blocks()
+        for job in jobs:
+            job['future'].cancel()
@@ -2,264 +2,725 @@ import torch
 import numpy as np
 import cv2
 from segment_anything import SamAutomaticMaskGenerator, sam_model_registry, SamPredictor
-from utils.omniparser import Omniparser
 from utils.utils import cv_to_base64
 import clip
-from PIL import Image
 from typing import List, Dict
 import os
-from datetime import datetime
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from .ImageHash import average_hash, hamming_distance, hash_array, hamming_matrix
+from .ObjectIndex import ObjectIndex
+from .DetectionCache import DetectionCache
+from .EmbeddingCache import EmbeddingCache
+from .IncrementalDetection import change_mask, change_ratio, changed_regions, inside_region, unchanged_objects
+from .ObjectDedup import dedup_objects
+from .LazyModel import LazyModel
+from .Cache import LRUCache
+from .DetectorBackends import DetectorBackend, register_backend, create_backend
+from .DebugSink import DebugSink
+from .DetectionWorker import DetectionWorkerPool
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
 
 class CLIP:
-    def __init__(self, model_name: str = "ViT-B/32", use_gpu: bool = True):
+    # normalisation constants of clip's own preprocess transform
+    MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+    STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+    def __init__(self, model_name: str = "ViT-B/32", use_gpu: bool = True, batch_size: int = 32):
 
         self.device = torch.device("cuda" if torch.cuda.is_available() and use_gpu else "cpu")
         
         self.model, self.preprocess = clip.load(model_name, device=self.device)
         self.model.eval()
+        self.name = model_name
+        self.input_resolution = self.model.visual.input_resolution
+        self.batch_size = batch_size
     
     def encode_text(self, text_query: str, max_length: int = 77) -> np.ndarray:
-        text_query = text_query[:max_length]
+        return self.encode_texts([text_query], max_length)
 
+    def encode_texts(self, text_queries: List[str], max_length: int = 77, batch_size: int = None) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        features = []
         with torch.no_grad():
-            text_tokens = clip.tokenize([text_query]).to(self.device)
-            text_features = self.model.encode_text(text_tokens)
-            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
-        
-        text_features_np = text_features.cpu().numpy()
-        return text_features_np
+            for start in range(0, len(text_queries), batch_size):
+                batch = [text_query[:max_length] for text_query in text_queries[start:start + batch_size]]
+                text_tokens = clip.tokenize(batch).to(self.device)
+                text_features = self.model.encode_text(text_tokens)
+                text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+                features.append(text_features.float().cpu().numpy())
+        return np.concatenate(features, axis=0)
     
     def encode_image(self, img_cv) -> np.ndarray:
-        pil_img = Image.fromarray(img_cv.astype('uint8'))
-        image = self.preprocess(pil_img).unsqueeze(0).to(self.device)
-        
+        return self.encode_images([img_cv])
+
+    def preprocess_images(self, imgs_cv) -> np.ndarray:
+        """
+        NumPy equivalent of clip's preprocess for a list of RGB uint8 images:
+        resize the short side, center crop, scale to [0, 1] and normalise. Returns NCHW float32.
+        Sizes and crop offsets are rounded as torchvision's Resize / CenterCrop do; see
+        scripts/test_clip_preprocess.py for the parity check against self.preprocess.
+        """
+        n_px = self.input_resolution
+        batch = np.empty((len(imgs_cv), n_px, n_px, 3), dtype=np.uint8)
+        for i, img in enumerate(imgs_cv):
+            img = img.astype(np.uint8)
+            height, width = img.shape[:2]
+            # torchvision truncates the long side
+            if width <= height:
+                new_w, new_h = n_px, int(n_px * height / width)
+            else:
+                new_w, new_h = int(n_px * width / height), n_px
+            # area averaging antialiases like PIL's bicubic when shrinking screenshots
+            interpolation = cv2.INTER_AREA if new_h < height else cv2.INTER_CUBIC
+            resized = cv2.resize(img, (new_w, new_h), interpolation=interpolation)
+            top, left = int(round((new_h - n_px) / 2.0)), int(round((new_w - n_px) / 2.0))
+            batch[i] = resized[top:top + n_px, left:left + n_px]
+        batch = (batch.astype(np.float32) / 255.0 - self.MEAN) / self.STD
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+    def encode_images(self, imgs_cv, batch_size: int = None) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        features = []
         with torch.no_grad():
-            features = self.model.encode_image(image)
-            features = features / features.norm(dim=-1, keepdim=True)
-        
-        features_np = features.cpu().numpy()
-        return features_np
+            for start in range(0, len(imgs_cv), batch_size):
+                images = torch.from_numpy(self.preprocess_images(imgs_cv[start:start + batch_size])).to(self.device)
+                image_features = self.model.encode_image(images)
+                image_features = image_features / image_features.norm(dim=-1, keepdim=True)
+                features.append(image_features.float().cpu().numpy())
+        return np.concatenate(features, axis=0)
     
+
+class OnnxCLIP(CLIP):
+    """
+    CLIP image and text encoders exported to ONNX and run under onnxruntime on CPU,
+    optionally with dynamic int8 weight quantization. The torch model is only loaded
+    to export the graphs the first time a model / quantization pair is used.
+    """
+    def __init__(self, model_name: str = "ViT-B/32", batch_size: int = 32, onnx_dir: str = 'weights/clip_onnx',
+                 quantize: bool = False, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        if onnxruntime is None:
+            raise ImportError("onnxruntime is required for the 'onnx' clip backend, please `pip install onnxruntime`")
+        self.device = torch.device("cpu")
+        self.batch_size = batch_size
+        # features of the int8 graph are not interchangeable with fp32 ones
+        self.name = f"{model_name}-onnx" + ('-int8' if quantize else '')
+
+        stem = os.path.join(onnx_dir, model_name.replace('/', '-'))
+        suffix = '.int8.onnx' if quantize else '.onnx'
+        image_path, text_path = stem + '-image' + suffix, stem + '-text' + suffix
+        if not (os.path.exists(image_path) and os.path.exists(text_path)):
+            self.export(model_name, stem, quantize)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.image_session = onnxruntime.InferenceSession(image_path, options, providers=['CPUExecutionProvider'])
+        self.text_session = onnxruntime.InferenceSession(text_path, options, providers=['CPUExecutionProvider'])
+        self.input_resolution = self.image_session.get_inputs()[0].shape[-1]
+
+    @staticmethod
+    def export(model_name, stem, quantize):
+        print(f"Exporting CLIP {model_name} to ONNX")
+        os.makedirs(os.path.dirname(stem), exist_ok=True)
+        model, _ = clip.load(model_name, device="cpu", jit=False)
+        model = model.float().eval()
+
+        class ImageEncoder(torch.nn.Module):
+            def forward(self, images):
+                features = model.encode_image(images)
+                return features / features.norm(dim=-1, keepdim=True)
+
+        class TextEncoder(torch.nn.Module):
+            def forward(self, tokens):
+                features = model.encode_text(tokens)
+                return features / features.norm(dim=-1, keepdim=True)
+
+        n_px = model.visual.input_resolution
+        with torch.no_grad():
+            torch.onnx.export(ImageEncoder(), torch.zeros(1, 3, n_px, n_px), stem + '-image.onnx', opset_version=14,
+                              input_names=['images'], output_names=['features'],
+                              dynamic_axes={'images': {0: 'batch'}, 'features': {0: 'batch'}})
+            torch.onnx.export(TextEncoder(), clip.tokenize(["a"]).long(), stem + '-text.onnx', opset_version=14,
+                              input_names=['tokens'], output_names=['features'],
+                              dynamic_axes={'tokens': {0: 'batch'}, 'features': {0: 'batch'}})
+
+        if quantize:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            for part in ['image', 'text']:
+                quantize_dynamic(f"{stem}-{part}.onnx", f"{stem}-{part}.int8.onnx", weight_type=QuantType.QInt8)
+
+    def encode_texts(self, text_queries: List[str], max_length: int = 77, batch_size: int = None) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        features = []
+        for start in range(0, len(text_queries), batch_size):
+            batch = [text_query[:max_length] for text_query in text_queries[start:start + batch_size]]
+            tokens = clip.tokenize(batch).numpy().astype(np.int64)
+            features.append(self.text_session.run(None, {'tokens': tokens})[0])
+        return np.concatenate(features, axis=0).astype(np.float32)
+
+    def encode_images(self, imgs_cv, batch_size: int = None) -> np.ndarray:
+        batch_size = batch_size or self.batch_size
+        features = []
+        for start in range(0, len(imgs_cv), batch_size):
+            images = self.preprocess_images(imgs_cv[start:start + batch_size])
+            features.append(self.image_session.run(None, {'images': images})[0])
+        return np.concatenate(features, axis=0).astype(np.float32)
+
+
+def clip_name(detector_config):
+    # same as CLIP.name / OnnxCLIP.name, without loading the model
+    backend = detector_config['clip_backend'] if 'clip_backend' in detector_config else 'torch'
+    if backend == 'onnx':
+        onnx_config = detector_config['onnx'] if 'onnx' in detector_config else {}
+        quantize = onnx_config['quantize'] if 'quantize' in onnx_config else False
+        return f"{detector_config['clip_model']}-onnx" + ('-int8' if quantize else '')
+    return detector_config['clip_model']
+
+def create_clip(detector_config):
+    # detector.clip_backend selects the torch model (default) or the onnxruntime export
+    backend = detector_config['clip_backend'] if 'clip_backend' in detector_config else 'torch'
+    batch_size = detector_config['clip_batch_size'] if 'clip_batch_size' in detector_config else 32
+    if backend == 'torch':
+        return CLIP(model_name=detector_config['clip_model'], use_gpu=True, batch_size=batch_size)
+    elif backend == 'onnx':
+        onnx_config = detector_config['onnx'] if 'onnx' in detector_config else {}
+        return OnnxCLIP(
+            model_name=detector_config['clip_model'],
+            batch_size=batch_size,
+            onnx_dir=onnx_config['dir'] if 'dir' in onnx_config else 'weights/clip_onnx',
+            quantize=onnx_config['quantize'] if 'quantize' in onnx_config else False,
+            intra_op_threads=onnx_config['intra_op_threads'] if 'intra_op_threads' in onnx_config else 0,
+            inter_op_threads=onnx_config['inter_op_threads'] if 'inter_op_threads' in onnx_config else 0,
+        )
+    else:
+        raise ValueError(f"Unsupported clip backend: {backend}")
+
+
+# SamAutomaticMaskGenerator settings per detection profile; input_scale downsizes the
+# frame before segmentation (bboxes are scaled back), num_threads sets torch CPU threads
+SAM_PROFILES = {
+    'default': {'input_scale': 1.0, 'points_per_side': 32, 'points_per_batch': 64, 'pred_iou_thresh': 0.9,
+                'stability_score_thresh': 0.92, 'crop_n_layers': 0, 'crop_n_points_downscale_factor': 1,
+                'min_mask_region_area': 100, 'num_threads': None},
+    'cpu': {'input_scale': 0.5, 'points_per_side': 16, 'points_per_batch': 128, 'pred_iou_thresh': 0.86,
+            'stability_score_thresh': 0.9, 'crop_n_layers': 0, 'crop_n_points_downscale_factor': 1,
+            'min_mask_region_area': 100, 'num_threads': None},
+    'cpu_fast': {'input_scale': 0.5, 'points_per_side': 12, 'points_per_batch': 144, 'pred_iou_thresh': 0.86,
+                 'stability_score_thresh': 0.88, 'crop_n_layers': 0, 'crop_n_points_downscale_factor': 1,
+                 'min_mask_region_area': 50, 'num_threads': None},
+}
+
+def sam_settings(detector_config):
+    # older configs keep sam_weights / sam_type directly under detector, a detector.sam
+    # section overrides them key by key
+    if 'sam' not in detector_config:
+        return dict(detector_config)
+    settings = {key: detector_config[key] for key in ('sam_weights', 'sam_type') if key in detector_config}
+    settings.update(detector_config['sam'])
+    return settings
+
+def sam_profile(sam_config):
+    # named profile from SAM_PROFILES, with any key overridden in the detector.sam section
+    name = sam_config['profile'] if 'profile' in sam_config else 'default'
+    if name not in SAM_PROFILES:
+        raise ValueError(f"Unsupported sam profile: {name}")
+    profile = dict(SAM_PROFILES[name])
+    for key in profile:
+        if key in sam_config:
+            profile[key] = sam_config[key]
+    return profile
+
+def build_sam_generator(sam, profile):
+    if profile['num_threads'] is not None:
+        torch.set_num_threads(profile['num_threads'])
+    return SamAutomaticMaskGenerator(
+        model=sam,
+        points_per_side=profile['points_per_side'],
+        points_per_batch=profile['points_per_batch'],
+        pred_iou_thresh=profile['pred_iou_thresh'],
+        stability_score_thresh=profile['stability_score_thresh'],
+        crop_n_layers=profile['crop_n_layers'],
+        crop_n_points_downscale_factor=profile['crop_n_points_downscale_factor'],
+        # measured on the downscaled input
+        min_mask_region_area=int(profile['min_mask_region_area'] * profile['input_scale'] ** 2),
+    )
+
+
+class CachedSamPredictor(SamPredictor):
+    """
+    SamPredictor that keeps the image embeddings of the last max_items images, keyed by a
+    digest of the pixels. set_image on an image seen before restores its embedding
+    instead of running the ViT encoder, and reset_image leaves the cache intact.
+    """
+    def __init__(self, sam_model, max_items=2):
+        super().__init__(sam_model)
+        self.embeddings = LRUCache(max_items=max_items, sizeof=lambda entry: entry[0].element_size() * entry[0].nelement())
+
+    def set_image(self, image: np.ndarray, image_format: str = "RGB"):
+        key = (image.shape, image_format, hashlib.blake2b(np.ascontiguousarray(image).tobytes(), digest_size=16).digest())
+        entry = self.embeddings.get(key)
+        if entry is not None:
+            self.reset_image()
+            self.features, self.original_size, self.input_size = entry
+            self.is_image_set = True
+            return
+        super().set_image(image, image_format)
+        self.embeddings.put(key, (self.features, self.original_size, self.input_size))
+
+
+class SamSession:
+    """
+    One SAM image embedding per frame, shared by the automatic mask generator (grid point
+    prompts in batches) and single-point prompts. Both run on the frame downscaled by the
+    profile's input_scale, so they hit the same cached embedding.
+    """
+    def __init__(self, sam, profile, max_items=2):
+        self.input_scale = profile['input_scale']
+        self.predictor = CachedSamPredictor(sam, max_items=max_items)
+        self.generator = build_sam_generator(sam, profile)
+        self.generator.predictor = self.predictor
+
+    def scaled(self, image):
+        if self.input_scale == 1.0:
+            return image
+        return cv2.resize(image, None, fx=self.input_scale, fy=self.input_scale, interpolation=cv2.INTER_AREA)
+
+    def generate(self, image: np.ndarray):
+        """Automatic masks of the frame, bboxes in frame coordinates."""
+        masks = self.generator.generate(self.scaled(image))
+        if self.input_scale != 1.0:
+            for mask in masks:
+                mask['bbox'] = [v / self.input_scale for v in mask['bbox']]
+        return masks
+
+    def segment_point(self, image: np.ndarray, x, y):
+        """Best mask for a foreground click at (x, y): {'bbox', 'score', 'mask'}, bbox and mask in frame coordinates."""
+        self.predictor.set_image(self.scaled(image))
+        point = np.array([[x * self.input_scale, y * self.input_scale]])
+        masks, scores, _ = self.predictor.predict(point_coords=point, point_labels=np.array([1]), multimask_output=True)
+        best = int(np.argmax(scores))
+        mask = masks[best].astype(np.uint8)
+        if self.input_scale != 1.0:
+            mask = cv2.resize(mask, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST)
+        x0, y0, w, h = cv2.boundingRect(mask)
+        return {'bbox': [x0, y0, w, h], 'score': float(scores[best]), 'mask': mask.astype(bool)}
+
+    def stats(self):
+        return self.predictor.embeddings.stats()
+
+
+@register_backend('sam')
+class SamBackend(DetectorBackend):
+    models = ['sam']
+
+    def proposals(self, image: np.ndarray):
+        masks = self.detector.sam_session.generate(image)
+        return [mask['bbox'] for mask in masks]
+
+
+@register_backend('omni')
+class OmniBackend(DetectorBackend):
+    models = ['omni']
+    min_center_y = 20
+
+    def proposals(self, image: np.ndarray):
+        _, coods_xywh_list, _ = self.detector.omniparser.parse(cv_to_base64(image))
+        return [[int(v) for v in coods_xywh_list[str(i)]] for i in range(len(coods_xywh_list))]
+
+
 class Detector:
     def __init__(self, config):
-        self.detector_type = config['detector']['type']
-        self.sam_type = config['detector']['sam']['sam_type']
+        detector_config = config['detector']
+        self.detector_type = detector_config['type'] if 'type' in detector_config else 'sam'
+        self.sam_config = sam_settings(detector_config)
+        self.sam_type = self.sam_config['sam_type'] if 'sam_type' in self.sam_config else None
+        self.omni_config = detector_config['omni'] if 'omni' in detector_config else None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        if self.detector_type == 'sam':
-            sam_config = config['detector']['sam']
-            sam = sam_model_registry[self.sam_type](checkpoint=sam_config['sam_weights'])
-            sam = sam.to(self.device)
-            
-            self.sam_predictor = SamAutomaticMaskGenerator(
-                model=sam,
-                points_per_side=32,
-                pred_iou_thresh=0.9,
-                stability_score_thresh=0.92,
-                min_mask_region_area=100,
-            )
-        elif self.detector_type == 'omni':
-            omni_config = config['detector']['omni']
-            self.omniparser = Omniparser(
-                som_model_path=omni_config['som_model_path'],
-                caption_model_name=omni_config['caption_model_name'],
-                caption_model_path=omni_config['caption_model_path'],
-                BOX_TRESHOLD=omni_config['BOX_TRESHOLD'],
-                iou_threshold=omni_config['iou_threshold'],
-                text_overlap_threshold=omni_config['text_overlap_threshold'],
-            )
+        self.sam_profile = sam_profile(self.sam_config)
+
+        # models are built on first use (or by prewarm), is_base runs never load a segmenter
+        self.models = {
+            'clip': LazyModel('clip', lambda: create_clip(detector_config)),
+            'sam': LazyModel('sam', self.load_sam),
+            'omni': LazyModel('omniparser', self.load_omniparser),
+        }
         
         self.area_threshold = 0.03
 
-        self.clip = CLIP(model_name=config['detector']['clip_model'], use_gpu=True)
-    
-    def encode_image(self, img_cv):
-        return self.clip.encode_image(img_cv)
-
-    def encode_text(self, text_query: str):
-        return self.clip.encode_text(text_query)
-    
-    # TODO: merge sam and omni
-    def extract_objects_sam(self, image: np.ndarray) -> List[Dict]:
-        height, width = image.shape[:2]
-        image_area = height * width
-
-        masks = self.sam_predictor.generate(image)
-        objects = []
-
-        for mask in masks:
-            bbox = mask['bbox']
-            x, y, w, h = bbox
-            x0, y0 = int(x), int(y)
-            x1, y1 = int(x + w), int(y + h)
-            area = w * h
-            rel_area = area / image_area
-
-            if rel_area > self.area_threshold or w <= 5 or h <= 5:
-                continue
-
-            cropped = image[y0:y1, x0:x1]
-            resized = cv2.resize(cropped, (32, 32))
-
-            gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
-            if np.std(gray) < 10: 
-                continue
-
-            hash_val = self._average_hash(resized)
-            center_x = (x0 + x1) // 2
-            center_y = (y0 + y1) // 2
+        # proposals come from the backend registered for detector_type; a cheap backend
+        # can hand frames where it finds fewer than min_objects to a fallback (e.g. sam)
+        self.detector_config = detector_config
+        self.backend = self.create_backend(self.detector_type)
+        fallback_config = detector_config['fallback'] if 'fallback' in detector_config else {}
+        self.fallback_backend = None
+        if 'type' in fallback_config and fallback_config['type'] != self.detector_type:
+            self.fallback_backend = self.create_backend(fallback_config['type'])
+        self.fallback_min_objects = fallback_config['min_objects'] if 'min_objects' in fallback_config else 5
+
+        # second rematch stage on CLIP crop embeddings, for objects whose hash drifted
+        semantic_config = detector_config['semantic_rematch'] if 'semantic_rematch' in detector_config else {}
+        self.semantic_rematch = semantic_config['enabled'] if 'enabled' in semantic_config else False
+        self.semantic_threshold = semantic_config['threshold'] if 'threshold' in semantic_config else 0.92
+        self.semantic_hash_threshold = semantic_config['hash_threshold'] if 'hash_threshold' in semantic_config else 24
+        self.semantic_area_tol = semantic_config['area_tol'] if 'area_tol' in semantic_config else 0.3
+
+        # skip segmentation on frames that were already detected with the same config
+        cache_config = detector_config['cache'] if 'cache' in detector_config else {}
+        self.detection_cache = None
+        if 'enabled' not in cache_config or cache_config['enabled']:
+            self.detection_cache = DetectionCache(
+                cache_dir=cache_config['dir'] if 'dir' in cache_config else config['game_name'] + '.detections',
+                settings=self.detection_settings(),
+                max_items=cache_config['max_items'] if 'max_items' in cache_config else 256,
+                max_memory_mb=cache_config['max_memory_mb'] if 'max_memory_mb' in cache_config else 128,
+                max_disk_mb=cache_config['max_disk_mb'] if 'max_disk_mb' in cache_config else 512,
+                tolerance=cache_config['tolerance'] if 'tolerance' in cache_config else 2.0,
+            )
 
-            if center_y < 25:
-                continue
+        # re-segment only the regions that changed since the last detected frame
+        incremental_config = detector_config['incremental'] if 'incremental' in detector_config else {}
+        self.incremental = incremental_config['enabled'] if 'enabled' in incremental_config else False
+        self.incremental_pad = incremental_config['pad'] if 'pad' in incremental_config else 32
+        self.incremental_max_change = incremental_config['max_change_ratio'] if 'max_change_ratio' in incremental_config else 0.3
+        self.last_frame = None
+        self.last_objects = []
+
+        # state features of recently seen frames, see encode_images
+        embedding_config = detector_config['embedding_cache'] if 'embedding_cache' in detector_config else {}
+        self.embedding_cache = None
+        if 'enabled' not in embedding_config or embedding_config['enabled']:
+            self.embedding_cache = EmbeddingCache(
+                model_name=clip_name(detector_config),
+                max_items=embedding_config['max_items'] if 'max_items' in embedding_config else 1024,
+                radius=embedding_config['radius'] if 'radius' in embedding_config else 4,
+                tolerance=embedding_config['tolerance'] if 'tolerance' in embedding_config else 2.0,
+                path=embedding_config['path'] if 'path' in embedding_config else None,
+            )
 
-            is_duplicate = False
-            # TODO: Check the O(n^2) efficiency
-            for prev_object in objects:
-                px, py = prev_object['center']
-                if abs(px - center_x) <= 6 and abs(py - center_y) <= 6:
-                    is_duplicate = True
-                    break
+        # detection in separate processes that keep the segmenters loaded, see extract_objects_async
+        workers_config = detector_config['workers'] if 'workers' in detector_config else {}
+        self.cache_lock = threading.Lock()
+        self.worker_pool = None
+        if 'enabled' in workers_config and workers_config['enabled']:
+            self.worker_pool = DetectionWorkerPool(
+                config,
+                num_workers=workers_config['num_workers'] if 'num_workers' in workers_config else 1,
+                max_retries=workers_config['max_retries'] if 'max_retries' in workers_config else 1,
+                max_restarts=workers_config['max_restarts'] if 'max_restarts' in workers_config else 10,
+            )
+        self.worker_timeout = workers_config['timeout'] if 'timeout' in workers_config else 120
+
+        # detection overlays for debugging, mode 'off' disables them
+        sink_config = detector_config['debug_sink'] if 'debug_sink' in detector_config else {}
+        self.debug_sink = DebugSink(
+            output_dir=sink_config['output_dir'] if 'output_dir' in sink_config else '../images',
+            mode=sink_config['mode'] if 'mode' in sink_config else 'async',
+            sample_rate=sink_config['sample_rate'] if 'sample_rate' in sink_config else 1.0,
+            max_files=sink_config['max_files'] if 'max_files' in sink_config else 500,
+            max_mb=sink_config['max_mb'] if 'max_mb' in sink_config else None,
+            format=sink_config['format'] if 'format' in sink_config else 'png',
+            jpeg_quality=sink_config['jpeg_quality'] if 'jpeg_quality' in sink_config else 85,
+            png_compression=sink_config['png_compression'] if 'png_compression' in sink_config else 1,
+        )
+    
+    def load_sam(self):
+        sam = sam_model_registry[self.sam_type](checkpoint=self.sam_config['sam_weights'])
+        sam = sam.to(self.device)
+        max_items = self.sam_config['embedding_cache_items'] if 'embedding_cache_items' in self.sam_config else 2
+        return SamSession(sam, self.sam_profile, max_items=max_items)
+
+    def load_omniparser(self):
+        # pulls in the YOLO and caption model stacks, only import them when omni is used
+        from utils.omniparser import Omniparser
+        omni_config = self.omni_config
+        return Omniparser(
+            som_model_path=omni_config['som_model_path'],
+            caption_model_name=omni_config['caption_model_name'],
+            caption_model_path=omni_config['caption_model_path'],
+            BOX_TRESHOLD=omni_config['BOX_TRESHOLD'],
+            iou_threshold=omni_config['iou_threshold'],
+            text_overlap_threshold=omni_config['text_overlap_threshold'],
+        )
+
+    @property
+    def clip(self):
+        return self.models['clip'].get()
+
+    @property
+    def sam_session(self):
+        return self.models['sam'].get()
+
+    @property
+    def sam_predictor(self):
+        # the automatic mask generator
+        return self.sam_session.generator
+
+    def segment_point(self, image: np.ndarray, x, y):
+        """Refine a click at (x, y) to the SAM mask under it, reusing the frame's embedding from detection."""
+        return self.sam_session.segment_point(image, x, y)
+
+    @property
+    def omniparser(self):
+        return self.models['omni'].get()
+
+    def prewarm(self, names):
+        """Start loading the named models ('clip', 'sam', 'omni') on background threads."""
+        for name in names:
+            self.models[name].prewarm()
+
+    def get_load_times(self):
+        return {name: model.load_time for name, model in self.models.items() if model.loaded}
 
-                hash_dist = self._hamming_distance(prev_object['hash'], hash_val)
-                if hash_dist <= 5:  
-                    is_duplicate = True
-                    break
+    def encode_image(self, img_cv):
+        return self.encode_images([img_cv])
+
+    def encode_images(self, imgs_cv):
+        if self.embedding_cache is None:
+            return self.clip.encode_images(imgs_cv)
+
+        features = [None] * len(imgs_cv)
+        thumbs = [None] * len(imgs_cv)
+        for i, img in enumerate(imgs_cv):
+            feature, thumbs[i] = self.embedding_cache.get(img)
+            if feature is not None:
+                features[i] = feature.reshape(1, -1)
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if len(missing) > 0:
+            encoded = self.clip.encode_images([imgs_cv[i] for i in missing])
+            for i, feature in zip(missing, encoded):
+                features[i] = feature.reshape(1, -1)
+                self.embedding_cache.put(thumbs[i], features[i])
+        return np.concatenate(features, axis=0)
 
-            if is_duplicate:
-                continue
-            
-            object_meta = {
-                'id': None,
-                'bbox': [x0, y0, w, h],
-                'area': area,
-                'hash': hash_val,
-                'center': (center_x, center_y),
-                'image': cropped
-            }
-            # print(object_meta)
-            objects.append(object_meta)
+    def encode_text(self, text_query: str):
+        return self.encode_texts([text_query])
 
+    def encode_texts(self, text_queries: List[str]):
+        return self.clip.encode_texts(text_queries)
+    
+    def backend_config(self, name):
+        return self.sam_config if name == 'sam' else (self.detector_config[name] if name in self.detector_config else None)
+
+    def create_backend(self, name):
+        return create_backend(name, self, self.backend_config(name))
+
+    def detection_settings(self):
+        # only what changes the proposals, the detection cache is keyed by it
+        settings = {'type': self.detector_type, 'backend': self.backend_config(self.detector_type),
+                    'area_threshold': self.area_threshold}
+        if self.fallback_backend is not None:
+            settings['fallback'] = {'type': self.fallback_backend.name, 'min_objects': self.fallback_min_objects,
+                                    'backend': self.backend_config(self.fallback_backend.name)}
+        return settings
+
+    def backend_models(self):
+        # with a worker pool the segmenters are loaded in the workers
+        if self.worker_pool is not None:
+            return []
+        models = list(self.backend.models)
+        if self.fallback_backend is not None:
+            models += [name for name in self.fallback_backend.models if name not in models]
+        return models
+
+    def detect_candidates(self, image: np.ndarray, region=None) -> List[Dict]:
+        return self.backend.candidates(image, region, self.area_threshold)
+
+    def detect_objects(self, image: np.ndarray) -> List[Dict]:
+        objects = dedup_objects(self.detect_candidates(image))
+        if self.fallback_backend is not None and len(objects) < self.fallback_min_objects:
+            print(f"{self.detector_type} found {len(objects)} objects, falling back to {self.fallback_backend.name}")
+            objects = dedup_objects(self.fallback_backend.candidates(image, None, self.area_threshold))
         return objects
 
-    def extract_objects_omni(self, image: np.ndarray) -> List[Dict]:
-        height, width = image.shape[:2]
-        image_area = height * width
-        base64_encoded_img = cv_to_base64(image)
-        _, coods_xywh_list, contents_list = self.omniparser.parse(base64_encoded_img)
-        objects = []
-
-        box_cnt = 0
-        for box_cnt in range(len(coods_xywh_list)):
-            bbox = coods_xywh_list[str(box_cnt)]
-            x, y, w, h = bbox
-            x0, y0 = int(x), int(y)
-            w, h = int(w), int(h)
-            x1, y1 = x0 + w, y0 + h
-            area = w * h
-            rel_area = area / image_area
-
-            if rel_area > self.area_threshold or w <= 5 or h <= 5:
-                continue
-
-            cropped = image[y0:y1, x0:x1]
-            resized = cv2.resize(cropped, (32, 32))
-
-            gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
-            if np.std(gray) < 10: 
-                continue
-
-            hash_val = self._average_hash(resized)
-            center_x = (x0 + x1) // 2
-            center_y = (y0 + y1) // 2
-
-            if center_y < 20:
-                continue
-
-            is_duplicate = False
-            for prev_object in objects:
-                px, py = prev_object['center']
-                if abs(px - center_x) <= 6 and abs(py - center_y) <= 6:
-                    is_duplicate = True
-                    break
+    def extract_objects_incremental(self, image: np.ndarray, prev_image: np.ndarray, prev_objects: List[Dict]):
+        """
+        Re-detect only the changed regions of `image` relative to `prev_image` and keep the
+        previous objects outside them. Returns None when too much of the frame changed.
+        """
+        mask = change_mask(prev_image, image)
+        if change_ratio(mask) > self.incremental_max_change:
+            return None
 
-                hash_dist = self._hamming_distance(prev_object['hash'], hash_val)
-                if hash_dist <= 5:  
-                    is_duplicate = True
-                    break
-
-            if is_duplicate:
+        height, width = image.shape[:2]
+        regions, dilated = changed_regions(mask, pad=self.incremental_pad)
+        # kept objects come first so keep-first dedup prefers them over re-detections
+        objects = [dict(obj, id=None) for obj in unchanged_objects(prev_objects, dilated)]
+        kept_num = len(objects)
+        for region in regions:
+            objects += [obj for obj in self.detect_candidates(image, region) if inside_region(obj['bbox'], region, width, height)]
+        print(f"Incremental detection: {len(regions)} changed regions, {kept_num} objects kept")
+        return dedup_objects(objects)
+
+    def _average_hash(self, image: np.ndarray) -> int:
+        return average_hash(image)
+
+    def _hamming_distance(self, hash1: int, hash2: int) -> int:
+        return hamming_distance(hash1, hash2)
+
+    def objects_rematch(self, objects: List[Dict], existed_objects, area_tol=0.1, hash_threshold=15) -> List[Dict]:
+        # existed_objects is a list of object dicts or a prebuilt ObjectIndex (e.g. LongMemory.get_object_index())
+        if isinstance(existed_objects, ObjectIndex):
+            index = existed_objects
+        else:
+            index = ObjectIndex(hash_threshold=hash_threshold, area_tol=area_tol)
+            index.add_objects(existed_objects)
+        if len(index) > 0:
+            for object in objects:
+                id, _ = index.nearest(object['hash'], object['area'], max_distance=hash_threshold)
+                if id is not None:
+                    object['id'] = id
+        # also on a new state with nothing to match, its objects still get their embeddings
+        if self.semantic_rematch and not isinstance(existed_objects, ObjectIndex):
+            self.objects_semantic_rematch(objects, existed_objects)
+
+    def objects_semantic_rematch(self, objects: List[Dict], existed_objects: List[Dict]):
+        """
+        Match the objects the hash stage left unmatched (e.g. cards whose numbers changed)
+        by cosine similarity of CLIP crop embeddings, among the existed objects within the
+        looser semantic hash / area pre-filters. Sets obj['feature'] on every object that
+        has no stored embedding yet, so LongMemory can persist it.
+        """
+        known = {obj['id']: obj['feature'] for obj in existed_objects if 'feature' in obj and obj['feature'] is not None}
+        # unmatched objects, and matches of objects stored before embeddings were kept
+        pending = [obj for obj in objects if obj['id'] is None or obj['id'] not in known]
+        if len(pending) == 0:
+            return
+        features = self.clip.encode_images([obj['image'] for obj in pending])
+        for obj, feature in zip(pending, features):
+            obj['feature'] = feature
+
+        unmatched = [obj for obj in pending if obj['id'] is None]
+        # one-to-one: ids the hash stage gave to objects of this frame are not candidates
+        assigned = {obj['id'] for obj in objects if obj['id'] is not None}
+        candidates = [obj for obj in existed_objects if obj['id'] in known and obj['id'] not in assigned and
+                      known[obj['id']].shape[-1] == features.shape[-1]]
+        if len(unmatched) == 0 or len(candidates) == 0:
+            return
+        query = np.stack([obj['feature'] for obj in unmatched])
+        matrix = np.stack([known[obj['id']].reshape(-1) for obj in candidates])
+        similarity = query @ matrix.T
+
+        areas = np.array([obj['area'] for obj in candidates], dtype=np.float64)
+        query_areas = np.array([obj['area'] for obj in unmatched], dtype=np.float64)
+        distances = hamming_matrix(hash_array([obj['hash'] for obj in unmatched]), hash_array([obj['hash'] for obj in candidates]))
+        allowed = (np.abs(query_areas[:, None] - areas[None, :]) / areas[None, :] <= self.semantic_area_tol) & \
+                  (distances <= self.semantic_hash_threshold)
+        similarity[~allowed] = -1.0
+
+        # greedy by descending similarity, every stored id is taken at most once
+        rows, cols = np.nonzero(similarity >= self.semantic_threshold)
+        order = np.argsort(-similarity[rows, cols], kind='stable')
+        matched = 0
+        for i, j in zip(rows[order], cols[order]):
+            obj, id = unmatched[i], candidates[j]['id']
+            if obj['id'] is not None or id in assigned:
                 continue
-            
-            object_meta = {
-                'id': None,
-                'bbox': [x0, y0, w, h],
-                'area': area,
-                'hash': hash_val,
-                'center': (center_x, center_y),
-                'image': cropped
-            }
-            # print(object_meta)
-            objects.append(object_meta)
-
-        self.save_image_with_bboxes(image, objects)
-        print('image with bounding boxes saved.')
+            obj['id'] = id
+            assigned.add(id)
+            # keeps the stored embedding
+            del obj['feature']
+            matched += 1
+        print(f"Semantic rematch: {matched}/{len(unmatched)} objects matched")
+
+    def save_image_with_bboxes(self, image: np.ndarray, objects: List[Dict]):
+        # drawing and encoding happen on the debug sink's writer thread
+        self.debug_sink.submit(image, objects)
+
+    def detect_frame(self, img):
+        # incremental detection against the last frame when possible, otherwise a full pass
+        objects = None
+        if self.incremental and self.last_frame is not None and self.last_frame.shape == img.shape:
+            objects = self.extract_objects_incremental(img, self.last_frame, self.last_objects)
+        if objects is None:
+            objects = self.detect_objects(img)
         return objects
 
-    
+    def extract_objects(self, img):
+        return self.wait_objects(img, self.extract_objects_async(img))
+
+    def extract_objects_async(self, img) -> Future:
+        """Future of the objects in img; detection runs in the worker pool when one is configured."""
+        future = Future()
+        if self.detection_cache is not None:
+            with self.cache_lock:
+                objects = self.detection_cache.get(img)
+            if objects is not None:
+                future.set_result(objects)
+                return future
+
+        if self.worker_pool is not None:
+            try:
+                future = self.worker_pool.submit(img)
+                # cached by wait_objects
+                future.from_worker = True
+                return future
+            except RuntimeError as e:
+                print(f"{e}, detecting in the main process")
+
+        future.set_result(self.detect_and_cache(img))
+        return future
+
+    def wait_objects(self, img, future):
+        try:
+            try:
+                objects = future.result(timeout=self.worker_timeout if self.worker_pool is not None else None)
+            except FutureTimeoutError:
+                # a hung worker is killed (and restarted by the pool), this frame is detected here;
+                # abandon is False when the result arrived in the meantime
+                if self.worker_pool.abandon(future):
+                    print(f"Detection worker timed out after {self.worker_timeout}s, detecting in the main process")
+                    return self.detect_and_cache(img)
+                objects = future.result()
+        except RuntimeError as e:
+            # the worker failed or crashed on this frame, retry it in the main process
+            print(e)
+            return self.detect_and_cache(img)
+        # on the caller's thread, before the caller adds features and ids to these dicts
+        if getattr(future, 'from_worker', False):
+            self.cache_objects(img, objects)
+        return objects
 
-    def _average_hash(self, image: np.ndarray) -> str:
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        resized = cv2.resize(gray, (8, 8))
-        avg = resized.mean()
-        return ''.join(['1' if pixel > avg else '0' for row in resized for pixel in row])
-
-    def _hamming_distance(self, hash1: str, hash2: str) -> int:
-        return sum(ch1 != ch2 for ch1, ch2 in zip(hash1, hash2))
-
-    def objects_rematch(self, objects: List[Dict], existed_objects: List[Dict], area_tol=0.1, hash_threshold=15) -> List[Dict]:
-        for object in objects:
-            for existed_object in existed_objects:
-                if abs(object['area'] - existed_object['area']) / existed_object['area'] > area_tol:
-                    continue
-                if self._hamming_distance(object['hash'], existed_object['hash']) <= hash_threshold:
-                    object['id'] = existed_object['id']
-                    break
-                # TODO: semantic matching
-
-    def save_image_with_bboxes(self, image: np.ndarray, objects: List[Dict], output_dir="../images"):
-        # Create timestamp for filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Create a copy of the image to draw on
-        image_with_boxes = image.copy()
-        
-        # Draw bounding boxes on the image
-        for idx, obj in enumerate(objects):
-            x0, y0, w, h = obj['bbox']
-            x1, y1 = x0 + w, y0 + h
-            
-            # Draw rectangle (bounding box)
-            cv2.rectangle(image_with_boxes, (x0, y0), (x1, y1), (0, 0, 255), 2)
-            
-            # Draw object ID/index
-            cv2.putText(image_with_boxes, str(idx), (x0, y0-5), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-        
-        # Save the image with bounding boxes
-        filename = f"detection_{timestamp}.png"
-        filepath = os.path.join(output_dir, filename)
-        
-        # Convert RGB to BGR for OpenCV saving
-        image_bgr = cv2.cvtColor(image_with_boxes, cv2.COLOR_RGB2BGR)
-        cv2.imwrite(filepath, image_bgr)
-        
-        print(f"Saved detection image with {len(objects)} objects to {filepath}")
+    def detect_and_cache(self, img):
+        objects = self.detect_frame(img)
+        self.cache_objects(img, objects)
+        return objects
 
-    def update_objects(self, img, existed_objects):
-        if self.detector_type == 'sam':
-            objects = self.extract_objects_sam(img)
-        elif self.detector_type == 'omni':
-            objects = self.extract_objects_omni(img)
+    def cache_objects(self, img, objects):
+        if self.detection_cache is not None:
+            with self.cache_lock:
+                self.detection_cache.put(img, objects)
+
+    def get_cache_stats(self):
+        stats = {}
+        if self.detection_cache is not None:
+            stats['detections'] = self.detection_cache.stats()
+        if self.embedding_cache is not None:
+            stats['embeddings'] = self.embedding_cache.stats()
+        stats['debug_sink'] = self.debug_sink.stats()
+        if self.worker_pool is not None:
+            stats['workers'] = self.worker_pool.stats()
+        if self.models['sam'].loaded:
+            stats['sam_embeddings'] = self.sam_session.stats()
+        return stats
+
+    def close(self):
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.save()
+        self.debug_sink.close()
+
+    def update_objects(self, img, existed_objects, future=None):
+        # future: from extract_objects_async(img), started while the caller did other work
+        objects = self.wait_objects(img, future if future is not None else self.extract_objects_async(img))
+        self.last_frame, self.last_objects = img, objects
         self.objects_rematch(objects, existed_objects)
         
         # Save the image with bounding boxes
@@ -0,0 +1,92 @@
+import numpy as np
+import cv2
+from typing import List, Dict
+from .ObjectDedup import make_object
+
+
+# detector type -> backend class, filled by register_backend
+DETECTOR_BACKENDS = {}
+
+def register_backend(name):
+    def register(cls):
+        cls.name = name
+        DETECTOR_BACKENDS[name] = cls
+        return cls
+    return register
+
+def create_backend(name, detector, config):
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unsupported detector type: {name}")
+    return DETECTOR_BACKENDS[name](detector, config)
+
+
+class DetectorBackend:
+    """
+    A source of object proposals. Backends only implement proposals(); candidates() is the
+    stage shared by all of them: boxes are mapped to frame coordinates and go through
+    make_object (area threshold, minimum size, top margin, std < 10).
+    """
+    name = None
+    models = []          # Detector.models the backend uses, for prewarm
+    min_center_y = 25
+
+    def __init__(self, detector, config):
+        self.detector = detector
+        self.config = config
+
+    def proposals(self, image: np.ndarray):
+        """(x, y, w, h) boxes in image coordinates."""
+        raise NotImplementedError
+
+    def candidates(self, image: np.ndarray, region=None, area_threshold=0.03) -> List[Dict]:
+        # region=(x0, y0, x1, y1) runs the backend on that crop only, boxes are mapped back to frame coordinates
+        ox, oy = (int(region[0]), int(region[1])) if region is not None else (0, 0)
+        crop = image[region[1]:region[3], region[0]:region[2]] if region is not None else image
+        candidates = []
+        for x, y, w, h in self.proposals(crop):
+            x0, y0 = int(x) + ox, int(y) + oy
+            x1, y1 = int(x + w) + ox, int(y + h) + oy
+            object_meta = make_object(image, x0, y0, x1, y1, w, h, area_threshold, self.min_center_y)
+            if object_meta is not None:
+                candidates.append(object_meta)
+        return candidates
+
+
+@register_backend('cv')
+class ClassicalBackend(DetectorBackend):
+    """
+    Model-free proposals for UI-like frames: bounding boxes of the contours of the dilated
+    Canny edge map, optionally joined by MSER regions. Runs on a copy downscaled to max_side.
+    """
+    def __init__(self, detector, config):
+        super().__init__(detector, config)
+        config = config if config is not None else {}
+        self.max_side = config['max_side'] if 'max_side' in config else 960
+        self.canny_low = config['canny_low'] if 'canny_low' in config else 50
+        self.canny_high = config['canny_high'] if 'canny_high' in config else 150
+        self.dilate = config['dilate'] if 'dilate' in config else 2
+        self.min_size = config['min_size'] if 'min_size' in config else 8
+        self.use_mser = config['mser'] if 'mser' in config else False
+        self.mser = cv2.MSER_create() if self.use_mser else None
+
+    def proposals(self, image: np.ndarray):
+        height, width = image.shape[:2]
+        scale = min(1.0, self.max_side / max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+        edges = cv2.Canny(gray, self.canny_low, self.canny_high)
+        if self.dilate > 0:
+            # joins glyphs and broken outlines into one component per element
+            edges = cv2.dilate(edges, np.ones((3, 3), dtype=np.uint8), iterations=self.dilate)
+        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = [cv2.boundingRect(contour) for contour in contours]
+        if self.mser is not None:
+            _, mser_boxes = self.mser.detectRegions(gray)
+            boxes += [tuple(box) for box in mser_boxes]
+
+        min_size = self.min_size * scale
+        # identical boxes come from the inner and outer contour of the same outline
+        boxes = {box for box in boxes if box[2] >= min_size and box[3] >= min_size}
+        return [(x / scale, y / scale, w / scale, h / scale) for x, y, w, h in sorted(boxes)]
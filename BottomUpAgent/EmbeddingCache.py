@@ -0,0 +1,111 @@
+import os
+import hashlib
+import numpy as np
+import cv2
+from .Cache import LRUCache
+from .ImageHash import hash_array, hamming_distances
+
+
+class EmbeddingCache:
+    """
+    CLIP embeddings keyed by a 32x32 gray thumbnail of the frame.
+    Identical thumbnails hit through a digest lookup; otherwise the entries whose
+    64-bit average hash is within `radius` bits are checked and the closest one is
+    served if its thumbnail is within `tolerance` mean absolute difference.
+    """
+    def __init__(self, model_name, max_items=1024, radius=4, tolerance=2.0, path=None):
+        self.model_name = model_name
+        self.radius = radius
+        self.tolerance = tolerance
+        self.path = path
+        self.entries = LRUCache(max_items=max_items)
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._arrays = None
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    @staticmethod
+    def thumbnail(image):
+        # strided ~64x64 sample first, area-resizing the full frame costs milliseconds
+        height, width = image.shape[:2]
+        sample = np.ascontiguousarray(image[::max(1, height // 64), ::max(1, width // 64)], dtype=np.uint8)
+        small = cv2.resize(sample, (32, 32), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    @staticmethod
+    def thumbnail_hash(thumb):
+        small = cv2.resize(thumb, (8, 8), interpolation=cv2.INTER_AREA)
+        return int.from_bytes(np.packbits(small > small.mean()).tobytes(), 'big')
+
+    @staticmethod
+    def digest(thumb):
+        return hashlib.blake2b(thumb.tobytes(), digest_size=16).digest()
+
+    def get(self, image):
+        """Cached feature of this frame or None; also returns the thumbnail for put()."""
+        thumb = self.thumbnail(image)
+        digest = self.digest(thumb)
+        entry = self.entries.get(digest)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry[2].copy(), thumb
+
+        if len(self.entries) > 0:
+            keys, hashes = self.arrays()
+            distances = hamming_distances(self.thumbnail_hash(thumb), hashes)
+            for i in np.argsort(distances, kind='stable'):
+                if distances[i] > self.radius:
+                    break
+                entry = self.entries.get(keys[i])
+                if entry is not None and np.mean(cv2.absdiff(entry[1], thumb)) <= self.tolerance:
+                    self.near_hits += 1
+                    return entry[2].copy(), thumb
+
+        self.misses += 1
+        return None, thumb
+
+    def put(self, thumb, feature):
+        self.entries.put(self.digest(thumb), (self.thumbnail_hash(thumb), thumb, feature))
+        self._arrays = None
+
+    def arrays(self):
+        # digests and hashes of the current entries, rebuilt after puts (which may also evict)
+        if self._arrays is None:
+            items = list(self.entries.items.items())
+            self._arrays = ([key for key, _ in items], hash_array([value[0][0] for _, value in items]))
+        return self._arrays
+
+    def save(self):
+        if self.path is None:
+            return
+        values = [value[0] for value in self.entries.items.values()]
+        if len(values) == 0:
+            return
+        np.savez(self.path, model_name=self.model_name,
+                 thumbs=np.stack([thumb for _, thumb, _ in values]),
+                 features=np.concatenate([feature.reshape(1, -1) for _, _, feature in values], axis=0))
+
+    def load(self):
+        try:
+            data = np.load(self.path)
+        except Exception as e:
+            print(f"Failed to load {self.path}: {e}")
+            return
+        if str(data['model_name']) != self.model_name:
+            print(f"{self.path} was built with {data['model_name']}, ignoring it")
+            return
+        for thumb, feature in zip(data['thumbs'], data['features']):
+            self.put(thumb, feature.reshape(1, -1))
+        print(f"Loaded embedding cache: {len(self.entries)} entries")
+
+    def stats(self):
+        total = self.exact_hits + self.near_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.near_hits) / total if total > 0 else 0.0,
+            "items": len(self.entries),
+        }
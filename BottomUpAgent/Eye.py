@@ -4,6 +4,7 @@ import mss
 # import win32gui
 import pyautogui
 import datetime
+from .IncrementalDetection import change_mask, change_ratio
 
 
 
@@ -63,15 +64,11 @@ class Eye:
     def detect_acted_cv(self, last_screenshot_cv, current_screenshot_cv):
         if last_screenshot_cv is None:
             return True
-        last_gray = cv2.cvtColor(last_screenshot_cv, cv2.COLOR_RGB2GRAY)
-        current_gray = cv2.cvtColor(current_screenshot_cv, cv2.COLOR_RGB2GRAY)
+        diff = change_mask(last_screenshot_cv, current_screenshot_cv)
 
-        diff = cv2.absdiff(last_gray, current_gray)
-        _, diff = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-
-        change_ratio = np.sum(diff) / (diff.shape[0] * diff.shape[1] * 255)
-        print(f"Change ratio: {change_ratio}")
-        if change_ratio > 0.015:
+        ratio = change_ratio(diff)
+        print(f"Change ratio: {ratio}")
+        if ratio > 0.015:
             return True
         return False
     
\ No newline at end of file
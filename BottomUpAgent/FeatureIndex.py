@@ -0,0 +1,287 @@
+import os
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+def normalize_features(features):
+    features = np.asarray(features, dtype=np.float32)
+    if features.ndim == 1:
+        features = features.reshape(1, -1)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+
+class ExactIndex:
+    """
+    Resident, contiguous float32 matrix of L2-normalised features.
+    A lookup is one matrix-vector product plus argmax (cosine similarity).
+    """
+    def __init__(self, dim=None, capacity=1024):
+        self.dim = dim
+        self.size = 0
+        self._capacity = capacity
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._features = None if dim is None else np.empty((capacity, dim), dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def features(self):
+        if self._features is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._features[:self.size]
+
+    def _reserve(self, n):
+        if self.size + n <= self._capacity and self._features is not None:
+            return
+        capacity = self._capacity
+        while capacity < self.size + n:
+            capacity *= 2
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self._ids[:self.size]
+        features = np.empty((capacity, self.dim), dtype=np.float32)
+        if self._features is not None:
+            features[:self.size] = self._features[:self.size]
+        self._ids, self._features, self._capacity = ids, features, capacity
+
+    def add(self, id, feature):
+        self.add_batch([id], feature)
+
+    def add_batch(self, ids, features):
+        if len(ids) == 0:
+            return
+        features = normalize_features(features)
+        if self.dim is None:
+            self.dim = features.shape[1]
+        self._reserve(len(ids))
+        self._ids[self.size:self.size + len(ids)] = ids
+        self._features[self.size:self.size + len(ids)] = features
+        self.size += len(ids)
+
+    def search(self, feature):
+        """Return (id, similarity) of the closest feature, or (None, -1) when empty."""
+        if self.size == 0:
+            return None, -1.0
+        query = normalize_features(feature)[0]
+        sims = self._features[:self.size] @ query
+        best = int(np.argmax(sims))
+        return int(self._ids[best]), float(sims[best])
+
+    def search_k(self, feature, k):
+        """Return (ids, similarities) of the k closest features, best first."""
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize_features(feature)[0]
+        sims = self._features[:self.size] @ query
+        return self._top_k(self._ids[:self.size], sims, k)
+
+    @staticmethod
+    def _top_k(ids, sims, k):
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return ids[top], sims[top]
+
+    def max_id(self):
+        return int(self.ids.max()) if self.size > 0 else 0
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, features=self.features)
+
+    def load(self, path):
+        data = np.load(path)
+        self.add_batch(data['ids'], data['features'])
+        return True
+
+
+class IVFIndex(ExactIndex):
+    """
+    Inverted-file index (spherical k-means lists) over the resident matrix.
+    Below exact_threshold entries it searches exhaustively like ExactIndex.
+    """
+    def __init__(self, exact_threshold=4096, nlist=None, nprobe=16, kmeans_iters=10, capacity=1024):
+        super().__init__(capacity=capacity)
+        self.exact_threshold = exact_threshold
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.centroids = None
+        self._trained_size = 0
+        self._lists = []
+        self._list_arrays = []
+
+    def add_batch(self, ids, features):
+        start = self.size
+        super().add_batch(ids, features)
+        if self.centroids is not None and self.size < 4 * self._trained_size:
+            self._assign(np.arange(start, self.size))
+        elif self.size >= self.exact_threshold:
+            # (re)train once the index has grown enough to unbalance the lists
+            self.train()
+
+    def train(self, seed=0):
+        n = self.size
+        nlist = self.nlist or min(1024, max(16, int(2 * np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample = self.features[rng.choice(n, size=min(n, 32 * nlist), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = counts > 0
+            starts = np.cumsum(counts) - counts
+            sums = np.zeros_like(centroids)
+            sums[nonempty] = np.add.reduceat(sample[np.argsort(assign, kind='stable')], starts[nonempty], axis=0)
+            # re-seed empty lists with random samples
+            sums[~nonempty] = sample[rng.choice(len(sample), size=int((~nonempty).sum()))]
+            centroids = normalize_features(sums)
+
+        self.centroids = centroids
+        self._trained_size = n
+        self._lists = [[] for _ in range(nlist)]
+        self._list_arrays = [None] * nlist
+        self._assign(np.arange(n))
+
+    def _assign(self, rows, chunk_size=65536):
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            assign = np.argmax(self._features[chunk] @ self.centroids.T, axis=1)
+            self._add_to_lists(chunk, assign)
+
+    def _add_to_lists(self, rows, assign):
+        order = np.argsort(assign, kind='stable')
+        lists, starts = np.unique(assign[order], return_index=True)
+        for c, group in zip(lists.tolist(), np.split(rows[order], starts[1:])):
+            self._lists[c].extend(group.tolist())
+            self._list_arrays[c] = None
+
+    def _list_rows(self, c):
+        if self._list_arrays[c] is None:
+            self._list_arrays[c] = np.array(self._lists[c], dtype=np.int64)
+        return self._list_arrays[c]
+
+    def search(self, feature):
+        ids, sims = self.search_k(feature, 1)
+        if len(ids) == 0:
+            return None, -1.0
+        return int(ids[0]), float(sims[0])
+
+    def search_k(self, feature, k):
+        if self.centroids is None:
+            return super().search_k(feature, k)
+        query = normalize_features(feature)[0]
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._list_rows(c) for c in probe])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        sims = self._features[rows] @ query
+        return self._top_k(self._ids[rows], sims, k)
+
+    def save(self, path):
+        assign = np.full(self.size, -1, dtype=np.int64)
+        for c, rows in enumerate(self._lists):
+            assign[rows] = c
+        centroids = self.centroids if self.centroids is not None else np.empty((0, self.dim or 0), dtype=np.float32)
+        np.savez(path, ids=self.ids, features=self.features, centroids=centroids, assign=assign,
+                 trained_size=self._trained_size)
+
+    def load(self, path):
+        data = np.load(path)
+        ExactIndex.add_batch(self, data['ids'], data['features'])
+        if len(data['centroids']) > 0:
+            self.centroids = data['centroids']
+            self._trained_size = int(data['trained_size'])
+            self._lists = [[] for _ in range(len(self.centroids))]
+            self._list_arrays = [None] * len(self.centroids)
+            assign = data['assign']
+            rows = np.flatnonzero(assign >= 0)
+            self._add_to_lists(rows, assign[rows])
+        return True
+
+
+class HNSWIndex(ExactIndex):
+    """
+    hnswlib graph over the resident matrix (optional dependency).
+    Below exact_threshold entries it searches exhaustively like ExactIndex.
+    """
+    def __init__(self, exact_threshold=4096, M=16, ef_construction=200, ef_search=64, capacity=1024):
+        if hnswlib is None:
+            raise ImportError("hnswlib is required for the 'hnsw' index backend, please `pip install hnswlib`")
+        super().__init__(capacity=capacity)
+        self.exact_threshold = exact_threshold
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.graph = None
+
+    def add_batch(self, ids, features):
+        start = self.size
+        super().add_batch(ids, features)
+        if self.graph is None and self.size >= self.exact_threshold:
+            self.graph = hnswlib.Index(space='ip', dim=self.dim)
+            self.graph.init_index(max_elements=2 * self.size, ef_construction=self.ef_construction, M=self.M)
+            self.graph.set_ef(self.ef_search)
+            start = 0
+        if self.graph is not None and start < self.size:
+            if self.size > self.graph.get_max_elements():
+                self.graph.resize_index(2 * self.size)
+            self.graph.add_items(self._features[start:self.size], self._ids[start:self.size])
+
+    def search(self, feature):
+        ids, sims = self.search_k(feature, 1)
+        if len(ids) == 0:
+            return None, -1.0
+        return int(ids[0]), float(sims[0])
+
+    def search_k(self, feature, k):
+        if self.graph is None:
+            return super().search_k(feature, k)
+        query = normalize_features(feature)
+        labels, distances = self.graph.knn_query(query, k=min(k, self.size))
+        # 'ip' distance is 1 - inner product
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+    def _graph_path(self, path):
+        return os.path.splitext(path)[0] + '.hnsw'
+
+    def save(self, path):
+        super().save(path)
+        if self.graph is not None:
+            self.graph.save_index(self._graph_path(path))
+
+    def load(self, path):
+        data = np.load(path)
+        ExactIndex.add_batch(self, data['ids'], data['features'])
+        graph_path = self._graph_path(path)
+        if os.path.exists(graph_path):
+            self.graph = hnswlib.Index(space='ip', dim=self.dim)
+            self.graph.load_index(graph_path, max_elements=2 * self.size)
+            self.graph.set_ef(self.ef_search)
+        elif self.size >= self.exact_threshold:
+            self.size = 0
+            self.add_batch(data['ids'], data['features'])
+        return True
+
+
+def create_index(index_config=None):
+    index_config = dict(index_config or {})
+    backend = index_config.pop('backend', 'exact')
+    if backend == 'exact':
+        return ExactIndex()
+    elif backend == 'ivf':
+        return IVFIndex(**index_config)
+    elif backend == 'hnsw':
+        return HNSWIndex(**index_config)
+    else:
+        raise ValueError(f"Unsupported index backend: {backend}")
@@ -0,0 +1,46 @@
+import numpy as np
+import cv2
+
+HASH_BITS = 64
+
+# popcount of every byte / 16-bit value, numpy 1.24 has no bitwise_count
+POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+POPCOUNT16 = (POPCOUNT8[np.arange(1 << 16) >> 8] + POPCOUNT8[np.arange(1 << 16) & 0xFF]).astype(np.uint8)
+
+
+def average_hash(image: np.ndarray) -> int:
+    """8x8 average hash packed into an unsigned 64-bit int, first pixel in the most significant bit."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    resized = cv2.resize(gray, (8, 8))
+    bits = np.packbits(resized > resized.mean())
+    return int.from_bytes(bits.tobytes(), 'big')
+
+def from_bit_string(hash_str: str) -> int:
+    # legacy '0101...' hashes use the same bit order
+    return int(hash_str, 2)
+
+def to_signed(hash_val: int) -> int:
+    # sqlite INTEGER is signed 64-bit
+    return hash_val - (1 << 64) if hash_val >= (1 << 63) else hash_val
+
+def from_signed(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def hash_array(hashes) -> np.ndarray:
+    return np.array([int(h) for h in hashes], dtype=np.uint64)
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    counts = POPCOUNT16[values.view(np.uint16)].reshape(values.shape + (4,))
+    # explicit adds are about twice as fast as sum(axis=-1) on the short arrays dedup passes
+    return (counts[..., 0] + counts[..., 1] + counts[..., 2] + counts[..., 3]).astype(np.int64)
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return (int(hash1) ^ int(hash2)).bit_count()
+
+def hamming_distances(hash_val: int, hashes: np.ndarray) -> np.ndarray:
+    """Distances from one hash to every entry of a uint64 array."""
+    return popcount(np.bitwise_xor(hashes, np.uint64(hash_val)))
+
+def hamming_matrix(hashes1: np.ndarray, hashes2: np.ndarray) -> np.ndarray:
+    return popcount(np.bitwise_xor(hashes1[:, None], hashes2[None, :]))
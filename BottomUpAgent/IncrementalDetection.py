@@ -0,0 +1,53 @@
+import numpy as np
+import cv2
+from typing import List, Dict
+
+
+def change_mask(last_screenshot_cv, current_screenshot_cv, threshold=30):
+    """Binary (0/255) mask of the pixels whose gray level changed by more than threshold."""
+    last_gray = cv2.cvtColor(last_screenshot_cv, cv2.COLOR_RGB2GRAY)
+    current_gray = cv2.cvtColor(current_screenshot_cv, cv2.COLOR_RGB2GRAY)
+
+    diff = cv2.absdiff(last_gray, current_gray)
+    _, diff = cv2.threshold(diff, threshold, 255, cv2.THRESH_BINARY)
+    return diff
+
+def change_ratio(mask):
+    return np.sum(mask) / (mask.shape[0] * mask.shape[1] * 255)
+
+def changed_regions(mask, pad=32, min_area=16):
+    """
+    Padded (x0, y0, x1, y1) boxes around the changed pixels. The mask is dilated
+    by `pad` first, so nearby changes end up in one region.
+    """
+    height, width = mask.shape[:2]
+    kernel = np.ones((2 * pad + 1, 2 * pad + 1), dtype=np.uint8)
+    dilated = cv2.dilate(mask, kernel)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(dilated)
+    regions = []
+    for label in range(1, n):
+        # plain ints, region offsets end up in object bboxes and JSON-serialized operations
+        x, y, w, h, area = (int(v) for v in stats[label])
+        if area < min_area:
+            continue
+        regions.append((max(0, x), max(0, y), min(width, x + w), min(height, y + h)))
+    return regions, dilated
+
+def inside_region(bbox, region, width, height):
+    # objects cut by a region border (that is not the frame border) are truncated crops
+    x0, y0, w, h = bbox
+    rx0, ry0, rx1, ry1 = region
+    return (x0 > rx0 or rx0 == 0) and (y0 > ry0 or ry0 == 0) and \
+           (x0 + w < rx1 or rx1 == width) and (y0 + h < ry1 or ry1 == height)
+
+def unchanged_objects(objects: List[Dict], dilated_mask) -> List[Dict]:
+    """Objects of the previous frame whose bbox does not touch any changed region."""
+    height, width = dilated_mask.shape[:2]
+    kept = []
+    for obj in objects:
+        x0, y0, w, h = obj['bbox']
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(width, int(x0 + w)), min(height, int(y0 + h))
+        if not np.any(dilated_mask[y0:y1, x0:x1]):
+            kept.append(obj)
+    return kept
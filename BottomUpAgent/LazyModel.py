@@ -0,0 +1,48 @@
+import time
+import threading
+import traceback
+
+
+class LazyModel:
+    """
+    Builds a model on first use. Safe to call get() from several threads, the factory
+    runs once; prewarm() starts that build on a background thread ahead of time.
+    """
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.model = None
+        self.error = None
+        self.load_time = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def get(self):
+        if self.model is not None:
+            return self.model
+        with self.lock:
+            # a failed prewarm leaves model None, so the caller retries and sees the error
+            if self.model is None:
+                time0 = time.time()
+                model = self.factory()
+                self.load_time = time.time() - time0
+                self.model = model
+                print(f"Loaded {self.name} in {self.load_time:.2f}s")
+        return self.model
+
+    def prewarm(self):
+        if self.model is not None or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._prewarm, name=f"prewarm-{self.name}", daemon=True)
+        self.thread.start()
+
+    def _prewarm(self):
+        try:
+            self.get()
+        except Exception as e:
+            traceback.print_exc()
+            self.error = e
@@ -2,22 +2,200 @@ import sqlite3
 import json
 import pickle
 import cv2
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import os
-from .Mcts import MCTS
+import copy
+import time
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+from .Mcts import MCTS, MCTS_NODE
+from .FeatureIndex import create_index
+from .BlobStore import BlobStore
+from .Cache import LRUCache
+from .ObjectIndex import ObjectIndex
+from .ImageHash import from_bit_string, to_signed, from_signed
+
+FEATURE_DTYPE = '<f4'  # raw little-endian float32
+
+
+def encode_feature(feature):
+    feature = np.ascontiguousarray(feature, dtype=FEATURE_DTYPE)
+    return feature.tobytes(), feature.size, FEATURE_DTYPE
+
+def decode_feature(blob, dim, dtype):
+    if dtype is None:
+        # legacy row: pickled ndarray
+        return pickle.loads(blob)
+    return np.frombuffer(blob, dtype=dtype).reshape(1, dim)
+
+def decode_hash(blob, bits):
+    if bits is None:
+        # legacy row: pickled '0101...' string
+        return pickle.loads(blob)
+    return format(int.from_bytes(blob, 'big'), f'0{bits}b')
+
+def read_hash(phash, blob, bits):
+    # objects.phash holds the signed 64-bit hash, older rows only have the hash BLOB
+    if phash is not None:
+        return from_signed(phash)
+    return from_bit_string(decode_hash(blob, bits))
+
 
 class LongMemory:
     def __init__(self, config):
         self.name = config["game_name"]
-        self.longmemory = sqlite3.connect(self.name+'.db')
-        self.sim_threshold = config['long_memory']['sim_threshold']
+        memory_config = config['long_memory']
+        # shared with the write-behind thread, see write()
+        self.longmemory = sqlite3.connect(self.name+'.db', check_same_thread=False)
+        self.sim_threshold = memory_config['sim_threshold']
+        self.set_pragmas(memory_config)
+
+        # unit-of-work state, see transaction()
+        self.transaction_depth = 0
+        # writes issued since the last commit; commit() is a no-op without any
+        self.uncommitted = False
+        self.commit_count = 0
+        self.commit_time = 0.0
+
+        # write-behind: one background thread encodes images and runs every write in order
+        self.write_queue = None
+        self.writer = None
+        self.writer_error = None
+        self.next_ids = {}
 
         if not self.is_initialized():
             self.initialize()
+        self.upgrade()
+        # screenshots and crops live in <game_name>.blobs, rows keep *_ref keys
+        self.blob_store = BlobStore(self.name + '.blobs', self.longmemory)
+
+        index_config = memory_config['index'] if 'index' in memory_config else {}
+        self.state_index = self.load_index('states', index_config)
+        self.skill_cluster_index = self.load_index('skill_clusters', index_config)
+
+        # decoded object crops used by operate_grounding, invalidated on every object write
+        object_cache_mb = memory_config['object_cache_mb'] if 'object_cache_mb' in memory_config else 64
+        self.object_image_cache = LRUCache(max_bytes=object_cache_mb * 1024 * 1024)
+        # hash/area index over the whole objects table, built on first use
+        self.object_index = None
+        # CLIP crop embeddings of objects (object_features rows), for semantic rematching
+        self.object_feature_cache = LRUCache()
+
+        # parsed skill / skill cluster rows, kept coherent by every skill and cluster write
+        self.skill_cache = LRUCache()
+        self.skill_cluster_cache = LRUCache()
+
+        if 'write_behind' in memory_config and memory_config['write_behind']:
+            queue_size = memory_config['write_queue_size'] if 'write_queue_size' in memory_config else 64
+            self.write_queue = queue.Queue(maxsize=queue_size)
+            self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+            self.writer.start()
 
         # self.objects = self.get_objects() 
 
+    def set_pragmas(self, memory_config):
+        synchronous = memory_config['synchronous'] if 'synchronous' in memory_config else 'NORMAL'
+        cache_size_kb = memory_config['cache_size_kb'] if 'cache_size_kb' in memory_config else 65536
+        cursor = self.longmemory.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode, only a power loss can drop the last commits
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA cache_size={-int(cache_size_kb)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group every write in the block into a single commit. Nested blocks join the outer one.
+        Writes made before an exception are still committed, as they were with per-call commits.
+        """
+        self.transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self.transaction_depth -= 1
+            self.commit()
+
+    def commit(self):
+        if self.transaction_depth > 0 or not self.uncommitted:
+            return
+        self.uncommitted = False
+        self.write(self.commit_now)
+
+    def commit_now(self):
+        time0 = time.time()
+        self.blob_store.sync()
+        self.longmemory.commit()
+        self.commit_count += 1
+        self.commit_time += time.time() - time0
+
+    def write(self, job, *args):
+        if job != self.commit_now:
+            self.uncommitted = True
+        if self.writer is None:
+            job(*args)
+        else:
+            # only blocks when the bounded queue is full
+            self.write_queue.put((job, args))
+
+    def writer_loop(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                self.write_queue.task_done()
+                break
+            job, args = item
+            try:
+                job(*args)
+            except Exception as e:
+                traceback.print_exc()
+                self.writer_error = e
+            finally:
+                self.write_queue.task_done()
+
+    def wait_writes(self):
+        # reads must see queued writes; in the game loop the queue has
+        # normally drained during the exec_duration sleeps
+        if self.writer is not None:
+            self.write_queue.join()
+
+    def flush(self):
+        """Barrier: return once every queued write is committed."""
+        self.commit()
+        self.wait_writes()
+        if self.writer_error is not None:
+            error, self.writer_error = self.writer_error, None
+            raise RuntimeError("LongMemory write-behind failed") from error
+
+    def reserve_id(self, table):
+        # ids are handed out before the row is written so callers never wait for the insert
+        if table not in self.next_ids:
+            self.wait_writes()
+            cursor = self.longmemory.cursor()
+            cursor.execute(f"SELECT MAX(id) FROM {table}")
+            self.next_ids[table] = (cursor.fetchone()[0] or 0) + 1
+        id = self.next_ids[table]
+        self.next_ids[table] += 1
+        return id
+
+    def execute(self, sql, params=()):
+        self.longmemory.cursor().execute(sql, params)
+
+    def get_cache_stats(self):
+        return {"object_images": self.object_image_cache.stats(),
+                "skills": self.skill_cache.stats(),
+                "skill_clusters": self.skill_cluster_cache.stats(),
+                "object_features": self.object_feature_cache.stats()}
+
+    def get_commit_stats(self):
+        return {
+            "commits": self.commit_count,
+            "commit_ms": self.commit_time * 1000,
+            "avg_commit_ms": self.commit_time * 1000 / self.commit_count if self.commit_count > 0 else 0.0,
+        }
+
     def is_initialized(self):
         # detect database whether has the table named init
         cursor = self.longmemory.cursor()
@@ -44,94 +222,393 @@ class LongMemory:
 
         self.longmemory.commit()
 
+    def upgrade(self):
+        # add columns introduced after a db was created
+        columns = {
+            'states': [('feature_dim', 'INTEGER'), ('feature_dtype', 'TEXT'), ('image_ref', 'TEXT')],
+            'skill_clusters': [('feature_dim', 'INTEGER'), ('feature_dtype', 'TEXT')],
+            'objects': [('hash_bits', 'INTEGER'), ('image_ref', 'TEXT'), ('phash', 'INTEGER')],
+            'skills': [('image1_ref', 'TEXT'), ('image2_ref', 'TEXT')],
+        }
+        cursor = self.longmemory.cursor()
+        for table, table_columns in columns.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            existed = [record[1] for record in cursor.fetchall()]
+            for name, type in table_columns:
+                if name not in existed:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {type}")
+
+        # one row per mcts node, states.mcts only keeps optimal_node_id and node_id
+        cursor.execute("CREATE TABLE IF NOT EXISTS mcts_nodes (state_id INTEGER, node_id INTEGER, parent_id INTEGER, value NUMERIC, " \
+        "operations TEXT, children_ids TEXT, n_visits INTEGER, is_fixed INTEGER, PRIMARY KEY (state_id, node_id))")
+
+        # cluster membership and state -> cluster links, replacing the JSON lists in
+        # skill_clusters.members and states.skill_clusters; rowid keeps insertion order
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='cluster_members'")
+        backfill = cursor.fetchone() is None
+        cursor.execute("CREATE TABLE IF NOT EXISTS cluster_members (cluster_id INTEGER, skill_id INTEGER, PRIMARY KEY (cluster_id, skill_id))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS state_clusters (state_id INTEGER, cluster_id INTEGER, PRIMARY KEY (state_id, cluster_id))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cluster_members_skill ON cluster_members (skill_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_state_clusters_cluster ON state_clusters (cluster_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_skills_state_id ON skills (state_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_skills_mcts_node_id ON skills (mcts_node_id)")
+
+        # CLIP embedding of an object's crop, written with the object or on its first rematch
+        cursor.execute("CREATE TABLE IF NOT EXISTS object_features (object_id INTEGER PRIMARY KEY, feature BLOB, feature_dim INTEGER, feature_dtype TEXT)")
+        if backfill:
+            self.backfill_memberships()
+        self.longmemory.commit()
+
+    def backfill_memberships(self):
+        cursor = self.longmemory.cursor()
+        cursor.execute("SELECT id, members FROM skill_clusters WHERE members IS NOT NULL")
+        rows = [(id, skill_id) for id, members in cursor.fetchall() for skill_id in json.loads(members)]
+        cursor.executemany("INSERT OR IGNORE INTO cluster_members (cluster_id, skill_id) VALUES (?, ?)", rows)
+        cursor.execute("SELECT id, skill_clusters FROM states WHERE skill_clusters IS NOT NULL")
+        rows = [(id, cluster_id) for id, skill_clusters in cursor.fetchall() for cluster_id in json.loads(skill_clusters)]
+        # drop links to clusters deleted while they were still JSON
+        cursor.executemany("INSERT OR IGNORE INTO state_clusters (state_id, cluster_id) SELECT ?, id FROM skill_clusters WHERE id = ?", rows)
+        print("Backfilled cluster_members and state_clusters")
+
+    def migrate(self, batch_size=500):
+        """
+        Convert legacy pickled features and hashes to raw storage in place.
+        Each batch is one transaction, so an interrupted migration can be resumed.
+        """
+        self.flush()
+        cursor = self.longmemory.cursor()
+        for table in ['states', 'skill_clusters']:
+            converted = 0
+            while True:
+                cursor.execute(f"SELECT id, state_feature FROM {table} WHERE feature_dtype IS NULL AND state_feature IS NOT NULL LIMIT ?", (batch_size,))
+                records = cursor.fetchall()
+                if len(records) == 0:
+                    break
+                rows = []
+                for id, feat_blob in records:
+                    rows.append(encode_feature(pickle.loads(feat_blob)) + (id,))
+                cursor.executemany(f"UPDATE {table} SET state_feature = ?, feature_dim = ?, feature_dtype = ? WHERE id = ?", rows)
+                self.commit_now()
+                converted += len(rows)
+            print(f"Migrated {table} features: {converted}")
+
+        converted = 0
+        while True:
+            cursor.execute("SELECT id, hash, hash_bits FROM objects WHERE phash IS NULL AND hash IS NOT NULL LIMIT ?", (batch_size,))
+            records = cursor.fetchall()
+            if len(records) == 0:
+                break
+            rows = [(to_signed(read_hash(None, hash_blob, hash_bits)), id) for id, hash_blob, hash_bits in records]
+            cursor.executemany("UPDATE objects SET phash = ?, hash = NULL, hash_bits = NULL WHERE id = ?", rows)
+            self.commit_now()
+            converted += len(rows)
+        print(f"Migrated objects hashes: {converted}")
+
+        converted = 0
+        cursor.execute("SELECT id, mcts FROM states")
+        for id, mcts_str in cursor.fetchall():
+            data = json.loads(mcts_str)
+            if 'nodes' in data:
+                self.write_mcts(id, *self.mcts_rows(MCTS.from_dict(data)))
+                converted += 1
+                if converted % batch_size == 0:
+                    self.commit_now()
+        self.commit_now()
+        print(f"Migrated mcts trees: {converted}")
+
+        image_columns = [('states', 'image', 'image_ref'), ('objects', 'image', 'image_ref'),
+                         ('skills', 'image1', 'image1_ref'), ('skills', 'image2', 'image2_ref')]
+        for table, column, ref_column in image_columns:
+            converted = 0
+            while True:
+                cursor.execute(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL AND {ref_column} IS NULL LIMIT ?", (batch_size,))
+                records = cursor.fetchall()
+                if len(records) == 0:
+                    break
+                rows = [(self.blob_store.put(bytes(image_blob)), id) for id, image_blob in records]
+                cursor.executemany(f"UPDATE {table} SET {ref_column} = ?, {column} = NULL WHERE id = ?", rows)
+                self.commit_now()
+                converted += len(rows)
+            print(f"Migrated {table}.{column} images: {converted}")
+
+    def vacuum(self):
+        # reclaim the pages freed by moving images out of the db
+        self.flush()
+        self.longmemory.execute("VACUUM")
+
+    """   Images   """
+    def put_image(self, image):
+        _, image_blob = cv2.imencode('.png', image)
+        return self.blob_store.put(image_blob.tobytes())
+
+    def decode_image(self, image_blob, image_ref):
+        # rows written before the blob store keep the png inline
+        if image_ref is not None:
+            image_blob = self.blob_store.get(image_ref)
+        if image_blob is None:
+            return None
+        return cv2.imdecode(np.frombuffer(image_blob, np.uint8), cv2.IMREAD_COLOR)
+
 
     """   Objects   """
         
     def get_object_by_ids(self, ids):
+        self.wait_writes()
         objects = []
         cursor = self.longmemory.cursor()
-        cursor.execute('SELECT id, name, image, hash, area FROM objects WHERE id IN ({})'.format(','.join('?'*len(ids))), ids)
+        cursor.execute('SELECT id, name, image, image_ref, phash, hash, hash_bits, area FROM objects WHERE id IN ({})'.format(','.join('?'*len(ids))), ids)
         records = cursor.fetchall()
 
-        for id, name, image_blob, hash_blob, area in records:
-            image = cv2.imdecode(np.frombuffer(image_blob, np.uint8), cv2.IMREAD_COLOR)
-            hash = pickle.loads(hash_blob)
+        for id, name, image_blob, image_ref, phash, hash_blob, hash_bits, area in records:
+            image = self.object_image_cache.get(id)
+            if image is None:
+                image = self.decode_image(image_blob, image_ref)
+                self.object_image_cache.put(id, image)
+            hash = read_hash(phash, hash_blob, hash_bits)
             objects.append({"id": id, "name": name, "image": image, "hash": hash, "area": area})
 
+        features = self.get_object_features([obj['id'] for obj in objects])
+        for obj in objects:
+            obj['feature'] = features[obj['id']] if obj['id'] in features else None
         return objects
+
+    def get_object_features(self, ids):
+        """Stored crop embeddings of the given objects as {id: (dim,) array}, objects without one are left out."""
+        features = {}
+        missing = []
+        for id in ids:
+            feature = self.object_feature_cache.get(id)
+            if feature is None:
+                missing.append(id)
+            else:
+                features[id] = feature
+        if len(missing) > 0:
+            self.wait_writes()
+            cursor = self.longmemory.cursor()
+            cursor.execute('SELECT object_id, feature, feature_dim, feature_dtype FROM object_features WHERE object_id IN ({})'.format(','.join('?'*len(missing))), missing)
+            for id, blob, dim, dtype in cursor.fetchall():
+                features[id] = decode_feature(blob, dim, dtype).reshape(-1)
+                self.object_feature_cache.put(id, features[id])
+        return features
     
     def update_objects(self, state, objects):
-        cursor = self.longmemory.cursor()
-        updated_objects_nums = 0
+        new_objects = []
         for obj in objects:
             if obj['id'] is None:
                 # New object
-                _, image_blob = cv2.imencode('.png', obj['image'])
-                image_blob = image_blob.tobytes()
-                hash_blob = pickle.dumps(obj['hash'])
-                cursor.execute("INSERT INTO objects (image, hash, area) VALUES (?, ?, ?)", (image_blob, hash_blob, obj['area']))
-                obj['id'] = cursor.lastrowid
+                obj['id'] = self.reserve_id('objects')
+                self.object_image_cache.pop(obj['id'])
                 state['object_ids'].append(obj['id'])
-                updated_objects_nums += 1
+                new_objects.append((obj['id'], obj['image'], to_signed(obj['hash']), obj['area']))
+
+        # embeddings set by Detector.objects_semantic_rematch, for new objects and older ones without
+        new_features = []
+        for obj in objects:
+            if 'feature' in obj and obj['feature'] is not None and obj['id'] not in self.object_feature_cache:
+                feature = np.asarray(obj['feature'], dtype=FEATURE_DTYPE).reshape(-1)
+                self.object_feature_cache.put(obj['id'], feature)
+                new_features.append((obj['id'], feature))
         
-        cursor.execute("UPDATE states SET object_ids = ? WHERE id = ?", (json.dumps(state['object_ids']), state['id']))
-        print(f"Updated objects nums: {updated_objects_nums}")
-        self.longmemory.commit()
+        if self.object_index is not None:
+            for id, _, phash, area in new_objects:
+                self.object_index.add(id, from_signed(phash), area)
+        self.write(self.insert_objects, new_objects, json.dumps(state['object_ids']), state['id'], new_features)
+        print(f"Updated objects nums: {len(new_objects)}")
+        self.commit()
         return objects
 
+    def get_object_index(self):
+        # for matching against every known object, not only those of the current state
+        if self.object_index is None:
+            self.wait_writes()
+            self.object_index = ObjectIndex()
+            cursor = self.longmemory.cursor()
+            cursor.execute('SELECT id, phash, hash, hash_bits, area FROM objects ORDER BY id')
+            for id, phash, hash_blob, hash_bits, area in cursor.fetchall():
+                self.object_index.add(id, read_hash(phash, hash_blob, hash_bits), area)
+            print(f"Loaded object index: {len(self.object_index)} entries")
+        return self.object_index
+
+    def insert_objects(self, new_objects, object_ids_str, state_id, new_features=()):
+        cursor = self.longmemory.cursor()
+        for id, image, phash, area in new_objects:
+            cursor.execute("INSERT INTO objects (id, image_ref, phash, area) VALUES (?, ?, ?, ?)", (id, self.put_image(image), phash, area))
+        cursor.executemany("INSERT OR IGNORE INTO object_features (object_id, feature, feature_dim, feature_dtype) VALUES (?, ?, ?, ?)",
+                           [(id,) + encode_feature(feature) for id, feature in new_features])
+        cursor.execute("UPDATE states SET object_ids = ? WHERE id = ?", (object_ids_str, state_id))
+
     def get_object_image_by_id(self, id):
+        image = self.object_image_cache.get(id)
+        if image is not None:
+            return image
+
+        self.wait_writes()
         cursor = self.longmemory.cursor()
-        cursor.execute('SELECT image FROM objects WHERE id = ?', (id,))
+        cursor.execute('SELECT image, image_ref FROM objects WHERE id = ?', (id,))
         record = cursor.fetchone()
 
         if record is None:
             return None
 
-        image_blob = record[0]
-        image = cv2.imdecode(np.frombuffer(image_blob, np.uint8), cv2.IMREAD_COLOR)
+        image = self.decode_image(record[0], record[1])
+        self.object_image_cache.put(id, image)
         return image
+
+    def update_object(self, id, image):
+        id = int(id)
+        self.object_image_cache.pop(id)
+        self.write(self.update_object_image, id, image)
+        self.commit()
+
+    def update_object_image(self, id, image):
+        self.execute("UPDATE objects SET image_ref = ?, image = NULL WHERE id = ?", (self.put_image(image), id))
     
+    """   MCTS   """
+    def load_mcts_nodes(self, state_id, node_ids=None):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        sql = 'SELECT node_id, parent_id, value, operations, children_ids, n_visits, is_fixed FROM mcts_nodes WHERE state_id = ?'
+        if node_ids is None:
+            cursor.execute(sql, (state_id,))
+        else:
+            cursor.execute(sql + ' AND node_id IN ({})'.format(','.join('?'*len(node_ids))), [state_id] + list(node_ids))
+
+        nodes = {}
+        for node_id, parent_id, value, operations, children_ids, n_visits, is_fixed in cursor.fetchall():
+            node = MCTS_NODE(node_id, parent_id=parent_id, value=value, operations=json.loads(operations),
+                             children_ids=json.loads(children_ids), n_visits=n_visits, is_fixed=bool(is_fixed))
+            node.dirty = False
+            nodes[node_id] = node
+        return nodes
+
+    def load_mcts(self, state_id, mcts_str):
+        data = json.loads(mcts_str)
+        if 'nodes' in data:
+            # legacy row with the whole tree inline, move it to mcts_nodes
+            mcts = MCTS.from_dict(data)
+            node_rows, deleted_node_ids, mcts_str = self.mcts_rows(mcts)
+            self.write(self.write_mcts, state_id, node_rows, deleted_node_ids, mcts_str)
+            return mcts
+        return MCTS(optimal_node_id=data['optimal_node_id'], node_id=data['node_id'],
+                    loader=lambda node_ids: self.load_mcts_nodes(state_id, node_ids))
+
+    def mcts_rows(self, mcts):
+        """Snapshot new or changed nodes and clear their dirty flags."""
+        nodes = mcts.dirty_nodes()
+        node_rows = [(node.node_id, node.parent_id, node.value, json.dumps(node.operations),
+                      json.dumps(node.children_ids), node.n_visits, int(node.is_fixed)) for node in nodes]
+        for node in nodes:
+            node.dirty = False
+        deleted_node_ids, mcts.deleted_node_ids = mcts.deleted_node_ids, []
+        return node_rows, deleted_node_ids, json.dumps(mcts.meta_dict())
+
+    def write_mcts(self, state_id, node_rows, deleted_node_ids, mcts_str):
+        cursor = self.longmemory.cursor()
+        if len(node_rows) > 0:
+            cursor.executemany("INSERT OR REPLACE INTO mcts_nodes (state_id, node_id, parent_id, value, operations, children_ids, n_visits, is_fixed) " \
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [(state_id,) + row for row in node_rows])
+        if len(deleted_node_ids) > 0:
+            cursor.executemany("DELETE FROM mcts_nodes WHERE state_id = ? AND node_id = ?",
+                               [(state_id, node_id) for node_id in deleted_node_ids])
+        cursor.execute("UPDATE states SET mcts = ? WHERE id = ?", (mcts_str, state_id))
+
     """   States   """
     def save_state(self, state):
-        state_feature_blob = pickle.dumps(state['state_feature'])
-        mcts_str = json.dumps(state['mcts'].to_dict())
+        feat_blob, feat_dim, feat_dtype = encode_feature(state['state_feature'])
         objects_ids_str = json.dumps(state['object_ids'])
-        skill_clusters_str = json.dumps(state['skill_clusters'])
-        image_blob = cv2.imencode('.png', state['image'])[1].tobytes()
 
-        cursor = self.longmemory.cursor()
-        cursor.execute("INSERT INTO states (state_feature, mcts, object_ids, skill_clusters, image) VALUES (?, ?, ?, ?, ?)", 
-                       (state_feature_blob, mcts_str, objects_ids_str, skill_clusters_str, image_blob))
-        self.longmemory.commit()
+        state_id = self.reserve_id('states')
+        self.write(self.insert_state, state_id, (feat_blob, feat_dim, feat_dtype), objects_ids_str, list(state['skill_clusters']),
+                   state['image'], self.mcts_rows(state['mcts']))
+        self.commit()
 
-        state_id = cursor.lastrowid
+        self.state_index.add(state_id, state['state_feature'])
         return state_id
 
-    def get_state(self, ob, sim_threshold=0.85):
+    def insert_state(self, state_id, feature, objects_ids_str, skill_cluster_ids, image, mcts_rows):
         cursor = self.longmemory.cursor()
-        cursor.execute('SELECT id, state_feature, mcts, object_ids, skill_clusters FROM states')
-        records = cursor.fetchall()
+        cursor.execute("INSERT INTO states (id, state_feature, feature_dim, feature_dtype, object_ids, image_ref) VALUES (?, ?, ?, ?, ?, ?)", 
+                       (state_id,) + feature + (objects_ids_str, self.put_image(image)))
+        self.write_state_clusters(state_id, skill_cluster_ids)
+        self.write_mcts(state_id, *mcts_rows)
+
+    def write_state_clusters(self, state_id, skill_cluster_ids):
+        cursor = self.longmemory.cursor()
+        cursor.execute("DELETE FROM state_clusters WHERE state_id = ?", (state_id,))
+        # clusters deleted in the meantime are skipped
+        cursor.executemany("INSERT OR IGNORE INTO state_clusters (state_id, cluster_id) SELECT ?, id FROM skill_clusters WHERE id = ?",
+                           [(state_id, cluster_id) for cluster_id in skill_cluster_ids])
+
+    def get_state_cluster_ids(self, state_id):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute("SELECT cluster_id FROM state_clusters WHERE state_id = ? ORDER BY rowid", (state_id,))
+        return [record[0] for record in cursor.fetchall()]
+
+    def index_path(self, table):
+        # sidecar file next to <game_name>.db
+        return f"{self.name}.{table}.idx.npz"
 
-        max_sim = -1
-        best_idx = None
+    def load_index(self, table, index_config):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute(f'SELECT MAX(id) FROM {table}')
+        db_max_id = cursor.fetchone()[0] or 0
+
+        index = create_index(index_config)
+        path = self.index_path(table)
+        if os.path.exists(path):
+            try:
+                index.load(path)
+            except Exception as e:
+                print(f"Failed to load {path}: {e}")
+                index = create_index(index_config)
+            if index.max_id() > db_max_id:
+                print(f"{path} does not match {self.name}.db, rebuilding")
+                index = create_index(index_config)
+
+        # append rows written after the sidecar was saved
+        cursor.execute(f'SELECT id, state_feature, feature_dim, feature_dtype FROM {table} WHERE id > ? ORDER BY id', (index.max_id(),))
+        records = cursor.fetchall()
+        if len(records) > 0:
+            ids = [record[0] for record in records]
+            feats = np.concatenate([decode_feature(*record[1:]).reshape(1, -1) for record in records], axis=0)
+            index.add_batch(ids, feats)
+        print(f"Loaded {table} index: {len(index)} entries")
+        return index
+
+    def save_indexes(self):
+        self.state_index.save(self.index_path('states'))
+        self.skill_cluster_index.save(self.index_path('skill_clusters'))
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.write_queue.put(None)
+            self.writer.join()
+            self.writer = None
+        self.save_indexes()
+        self.longmemory.close()
+        self.blob_store.close()
+
+    def match_state(self, state_feature):
+        # best (state_id, similarity) over all states, without touching the states table
+        return self.state_index.search(state_feature)
 
-        state_feature = ob['state_feature'].reshape(1, -1)    
-        for idx in range(len(records)):
-            feat_blob = records[idx][1]
-            feat = pickle.loads(feat_blob).reshape(1, -1)
-            sim = cosine_similarity(state_feature, feat)[0][0]
-            if sim > max_sim:
-                max_sim = sim
-                best_idx = idx
+    def get_state(self, ob, sim_threshold=0.85):
+        best_id, max_sim = self.match_state(ob['state_feature'])
 
-        if max_sim > sim_threshold:
-            record = records[best_idx]
+        if best_id is not None and max_sim > sim_threshold:
+            self.wait_writes()
+            cursor = self.longmemory.cursor()
+            cursor.execute('SELECT id, state_feature, feature_dim, feature_dtype, mcts, object_ids FROM states WHERE id = ?', (best_id,))
+            record = cursor.fetchone()
             state = {
                 "id": record[0],
-                "state_feature": pickle.loads(record[1]),
-                "mcts": MCTS.from_dict(json.loads(record[2])),
-                "object_ids": json.loads(record[3]),
-                "skill_clusters": json.loads(record[4]),
+                "state_feature": decode_feature(record[1], record[2], record[3]),
+                "mcts": self.load_mcts(record[0], record[4]),
+                "object_ids": json.loads(record[5]),
+                "skill_clusters": self.get_state_cluster_ids(record[0]),
                 "image": ob['screen'],
             }
             return state
@@ -139,148 +616,232 @@ class LongMemory:
             return None
             
     def update_state(self, state):
-        mcts_str = json.dumps(state['mcts'].to_dict())
         objects_ids_str = json.dumps(state['object_ids'])
-        skill_clusters_str = json.dumps(state['skill_clusters'])
 
-        cursor = self.longmemory.cursor()
-        cursor.execute("UPDATE states SET mcts = ?, object_ids = ?, skill_clusters = ? WHERE id = ?", 
-                       (mcts_str, objects_ids_str, skill_clusters_str, state['id']))
-        self.longmemory.commit()
+        self.write(self.write_mcts, state['id'], *self.mcts_rows(state['mcts']))
+        self.write(self.execute, "UPDATE states SET object_ids = ? WHERE id = ?", (objects_ids_str, state['id']))
+        self.write(self.write_state_clusters, state['id'], list(state['skill_clusters']))
+        self.commit()
 
     """   skill clusters   """
     
     def get_skill_clusters_by_id(self, id):
-        cursor = self.longmemory.cursor()
-        cursor.execute('SELECT id, name, description, members, explore_nums FROM skill_clusters WHERE id = ?', (id,))
-        record = cursor.fetchone()
-
-        if record is None:
-            return None
+        skill_cluster = self.skill_cluster_cache.get(id)
+        if skill_cluster is not None:
+            return copy.deepcopy(skill_cluster)
 
-        skill_cluster = {
-            "id": record[0],
-            "name": record[1],
-            "description": record[2],
-            "members": json.loads(record[3]),
-            "explore_nums": record[4]
-        }
-        return skill_cluster
+        skill_clusters = self.get_skill_clusters_by_ids([id])
+        return skill_clusters[0] if len(skill_clusters) > 0 else None
         
     def save_skill_cluster(self, state_feature, name, description, members, explore_nums=1):
-        state_feature_blob = pickle.dumps(state_feature)
+        feat_blob, feat_dim, feat_dtype = encode_feature(state_feature)
 
-        cursor = self.longmemory.cursor()
-        cursor.execute("INSERT INTO skill_clusters(state_feature, name, description, members, explore_nums) VALUES (?, ?, ?, ?, ?)", \
-                       (state_feature_blob, name, description, json.dumps(members), explore_nums))
-        
-        skill_cluster_id = cursor.lastrowid
-        self.longmemory.commit()
+        skill_cluster_id = self.reserve_id('skill_clusters')
+        self.write(self.execute, "INSERT INTO skill_clusters(id, state_feature, feature_dim, feature_dtype, name, description, explore_nums) VALUES (?, ?, ?, ?, ?, ?, ?)", \
+                   (skill_cluster_id, feat_blob, feat_dim, feat_dtype, name, description, explore_nums))
+        self.write(self.write_cluster_members, skill_cluster_id, list(members))
+        self.commit()
+        self.skill_cluster_index.add(skill_cluster_id, state_feature)
+        self.skill_cluster_cache.put(skill_cluster_id, {"id": skill_cluster_id, "name": name, "description": description,
+                                                        "members": list(members), "explore_nums": explore_nums})
 
         return skill_cluster_id
+
+    def get_skill_clusters_by_feature(self, state_feature, sim_threshold=0.85, k=16):
+        ids, sims = self.skill_cluster_index.search_k(state_feature, k)
+        ids = [int(id) for id, sim in zip(ids, sims) if sim > sim_threshold]
+        if len(ids) == 0:
+            return []
+        # deleted clusters stay in the index and are dropped by the id lookup
+        return self.get_skill_clusters_by_ids(ids)
     
     def get_skill_clusters_by_ids(self, ids):
-        skill_clusters = []
-        cursor = self.longmemory.cursor()
-        cursor.execute('SELECT id, name, description, members, explore_nums FROM skill_clusters WHERE id IN ({})'.format(','.join('?'*len(ids))), ids)
-        records = cursor.fetchall()
-
+        ids = sorted(set(ids))
+        missing = [id for id in ids if id not in self.skill_cluster_cache]
+        if len(missing) > 0:
+            self.wait_writes()
+            cursor = self.longmemory.cursor()
+            cursor.execute('SELECT c.id, c.name, c.description, c.explore_nums, m.skill_id FROM skill_clusters c ' \
+                           'LEFT JOIN cluster_members m ON m.cluster_id = c.id WHERE c.id IN ({}) ORDER BY c.id, m.rowid'.format(','.join('?'*len(missing))), missing)
+            for skill_cluster in self.group_clusters(cursor.fetchall()):
+                self.skill_cluster_cache.put(skill_cluster['id'], skill_cluster)
+
+        return self.cached_copies(self.skill_cluster_cache, ids)
+
+    @staticmethod
+    def group_clusters(records, skill_columns=1):
+        # rows of (cluster columns..., member columns...) ordered by cluster -> cluster dicts
+        skill_clusters = {}
         for record in records:
-            skill_cluster = {"id": record[0], "name": record[1], "description": record[2], "members": json.loads(record[3]), "explore_nums": record[4]}
-            skill_clusters.append(skill_cluster)
-
-        return skill_clusters
+            if record[0] not in skill_clusters:
+                skill_clusters[record[0]] = {"id": record[0], "name": record[1], "description": record[2],
+                                             "members": [], "explore_nums": record[3]}
+                if skill_columns > 1:
+                    skill_clusters[record[0]]["skills"] = []
+            if record[4] is None:
+                continue
+            skill_clusters[record[0]]["members"].append(record[4])
+            if skill_columns > 1:
+                skill_clusters[record[0]]["skills"].append(LongMemory.skill_from_record(record[4:]))
+        return list(skill_clusters.values())
+
+    def cached_copies(self, cache, ids):
+        # callers mutate members / operations in place, never hand out the cached dicts
+        entries = [cache.get(id) for id in ids]
+        return [copy.deepcopy(entry) for entry in entries if entry is not None]
     
     def update_skill_cluster(self, id, state_feature, name, description, members):
 
-        cursor = self.longmemory.cursor()
-        cursor.execute("UPDATE skill_clusters SET name = ?, description = ?, members = ? WHERE id = ?", \
-                       (name, description, json.dumps(members), id))
-        self.longmemory.commit()
+        self.write(self.execute, "UPDATE skill_clusters SET name = ?, description = ? WHERE id = ?", (name, description, id))
+        self.write(self.write_cluster_members, id, list(members))
+        self.commit()
+        skill_cluster = self.skill_cluster_cache.get(id)
+        if skill_cluster is not None:
+            skill_cluster.update({"name": name, "description": description, "members": list(members)})
 
     def update_skill_cluster_explore_nums(self, id, explore_nums):
+        self.write(self.execute, "UPDATE skill_clusters SET explore_nums = ? WHERE id = ?", (explore_nums, id))
+        self.commit()
+        skill_cluster = self.skill_cluster_cache.get(id)
+        if skill_cluster is not None:
+            skill_cluster['explore_nums'] = explore_nums
+
+    def write_cluster_members(self, cluster_id, members):
         cursor = self.longmemory.cursor()
-        cursor.execute("UPDATE skill_clusters SET explore_nums = ? WHERE id = ?", (explore_nums, id))
-        self.longmemory.commit()
+        cursor.execute("DELETE FROM cluster_members WHERE cluster_id = ?", (cluster_id,))
+        cursor.executemany("INSERT OR IGNORE INTO cluster_members (cluster_id, skill_id) VALUES (?, ?)",
+                           [(cluster_id, skill_id) for skill_id in members])
+
+    def get_clusters_by_skill(self, skill_id):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute("SELECT cluster_id FROM cluster_members WHERE skill_id = ?", (skill_id,))
+        return self.get_skill_clusters_by_ids([record[0] for record in cursor.fetchall()])
+
+    def get_state_skill_clusters(self, state_id):
+        """
+        Clusters of a state with their member skills, in one joined query.
+        Each cluster dict carries the usual fields plus "skills".
+        """
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute('SELECT c.id, c.name, c.description, c.explore_nums, ' \
+                       's.id, s.name, s.description, s.operations, s.fitness, s.num, s.state_id, s.mcts_node_id ' \
+                       'FROM state_clusters sc JOIN skill_clusters c ON c.id = sc.cluster_id ' \
+                       'LEFT JOIN cluster_members m ON m.cluster_id = c.id LEFT JOIN skills s ON s.id = m.skill_id ' \
+                       'WHERE sc.state_id = ? ORDER BY sc.rowid, m.rowid', (state_id,))
+        skill_clusters = self.group_clusters(cursor.fetchall(), skill_columns=8)
+
+        for skill_cluster in skill_clusters:
+            for skill in skill_cluster['skills']:
+                self.skill_cache.put(skill['id'], copy.deepcopy(skill))
+            self.skill_cluster_cache.put(skill_cluster['id'], {key: copy.deepcopy(value) for key, value in skill_cluster.items() if key != 'skills'})
+        return skill_clusters
 
 
     """   skills   """
     
     def save_skill(self, name, description, operations, fitness, num, state_id, mcts_node_id, image1, image2):
-        _, image1_blob = cv2.imencode('.png', image1)
-        image1_blob = image1_blob.tobytes()
-        _, image2_blob = cv2.imencode('.png', image2)
-        image2_blob = image2_blob.tobytes()
+        skill_id = self.reserve_id('skills')
+        self.write(self.insert_skill, (skill_id, name, description, json.dumps(operations), fitness, num, state_id, mcts_node_id), image1, image2)
+        self.commit()
+        self.skill_cache.put(skill_id, {"id": skill_id, "name": name, "description": description, "operations": copy.deepcopy(operations),
+                                        "fitness": fitness, "num": num, "state_id": state_id, "mcts_node_id": mcts_node_id})
+
+        return skill_id
 
+    def insert_skill(self, row, image1, image2):
+        # png encoding of both screenshots happens here, off the game loop in write-behind mode
         cursor = self.longmemory.cursor()
-        cursor.execute("INSERT INTO skills (name, description, operations, fitness, num, state_id, mcts_node_id, image1, image2) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", \
-                       (name, description, json.dumps(operations), fitness, num, state_id, mcts_node_id, image1_blob, image2_blob))
-        self.longmemory.commit()
+        cursor.execute("INSERT INTO skills (id, name, description, operations, fitness, num, state_id, mcts_node_id, image1_ref, image2_ref) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+                       row + (self.put_image(image1), self.put_image(image2)))
 
-        skill_id = cursor.lastrowid
-        return skill_id
+    def get_skill_images(self, id):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute('SELECT image1, image1_ref, image2, image2_ref FROM skills WHERE id = ?', (id,))
+        record = cursor.fetchone()
+
+        if record is None:
+            return None, None
+
+        return self.decode_image(record[0], record[1]), self.decode_image(record[2], record[3])
 
     def update_skill(self, id, fitness, num):
-        cursor = self.longmemory.cursor()
-        cursor.execute("UPDATE skills SET fitness = ?, num = ? WHERE id = ?", (fitness, num, id))
-        self.longmemory.commit()
+        self.write(self.execute, "UPDATE skills SET fitness = ?, num = ? WHERE id = ?", (fitness, num, id))
+        self.commit()
+        skill = self.skill_cache.get(id)
+        if skill is not None:
+            skill.update({"fitness": fitness, "num": num})
 
     
+    @staticmethod
+    def skill_from_record(record):
+        return {
+            "id": record[0],
+            "name": record[1],
+            "description": record[2],
+            "operations": json.loads(record[3]),
+            "fitness": record[4],
+            "num": record[5],
+            "state_id": record[6],
+            "mcts_node_id": record[7]
+        }
+
+    def get_skills_by_state(self, state_id):
+        self.wait_writes()
+        cursor = self.longmemory.cursor()
+        cursor.execute('SELECT id, name, description, operations, fitness, num, state_id, mcts_node_id FROM skills WHERE state_id = ?', (state_id,))
+        return [self.skill_from_record(record) for record in cursor.fetchall()]
+
     def get_skills_by_ids(self, ids):
-        skills = []
+        ids = sorted(set(ids))
+        missing = [id for id in ids if id not in self.skill_cache]
+        if len(missing) == 0:
+            return self.cached_copies(self.skill_cache, ids)
+
+        self.wait_writes()
         cursor = self.longmemory.cursor()
-        cursor.execute('SELECT id, name, description, operations, fitness, num, state_id, mcts_node_id FROM skills WHERE id IN ({})'.format(','.join('?'*len(ids))), ids)
+        cursor.execute('SELECT id, name, description, operations, fitness, num, state_id, mcts_node_id FROM skills WHERE id IN ({})'.format(','.join('?'*len(missing))), missing)
         records = cursor.fetchall()
 
         for record in records:
-            skill = {
-                "id": record[0],
-                "name": record[1],
-                "description": record[2],
-                "operations": json.loads(record[3]),
-                "fitness": record[4],
-                "num": record[5],
-                "state_id": record[6],
-                "mcts_node_id": record[7]
-            }
-            skills.append(skill)
+            skill = self.skill_from_record(record)
+            self.skill_cache.put(skill['id'], skill)
 
-        return skills
+        return self.cached_copies(self.skill_cache, ids)
 
     def delete_skill(self, skill, skill_cluster):
-        cursor = self.longmemory.cursor()
-        
         # delete skill from skill cluster
         if skill['id'] in skill_cluster['members']:
             skill_cluster['members'].remove(skill['id'])
+            self.write(self.execute, "DELETE FROM cluster_members WHERE cluster_id = ? AND skill_id = ?", (skill_cluster['id'], skill['id']))
             if len(skill_cluster['members']) == 0:
-                cursor.execute("DELETE FROM skill_clusters WHERE id = ?", (skill_cluster['id'],))
+                self.write(self.execute, "DELETE FROM skill_clusters WHERE id = ?", (skill_cluster['id'],))
+                self.write(self.execute, "DELETE FROM state_clusters WHERE cluster_id = ?", (skill_cluster['id'],))
+                self.skill_cluster_cache.pop(skill_cluster['id'])
             else:
-                cursor.execute("UPDATE skill_clusters SET members = ? WHERE id = ?", (json.dumps(skill_cluster['members']), skill_cluster['id']))
+                cached_cluster = self.skill_cluster_cache.get(skill_cluster['id'])
+                if cached_cluster is not None:
+                    cached_cluster['members'] = list(skill_cluster['members'])
 
         # delete skill from skills
         id = skill['id']
-        cursor.execute("DELETE FROM skills WHERE id = ?", (id,))
-        self.longmemory.commit()
+        self.write(self.execute, "DELETE FROM skills WHERE id = ?", (id,))
+        self.commit()
+        self.skill_cache.pop(id)
 
     def get_skills(self):
+        self.wait_writes()
         cursor = self.longmemory.cursor()
         cursor.execute('SELECT id, name, description, operations, fitness, num, state_id, mcts_node_id FROM skills')
         records = cursor.fetchall()
 
         skills = []
         for record in records:
-            skill = {
-                "id": record[0],
-                "name": record[1],
-                "description": record[2],
-                "operations": json.loads(record[3]),
-                "fitness": record[4],
-                "num": record[5],
-                "state_id": record[6],
-                "mcts_node_id": record[7]
-            }
-            skills.append(skill)
+            skill = self.skill_from_record(record)
+            self.skill_cache.put(skill['id'], skill)
+            skills.append(copy.deepcopy(skill))
 
         return skills
         
@@ -1,6 +1,9 @@
 import numpy as np
 
 class MCTS_NODE():
+    # attributes persisted per node, assigning any of them marks the node dirty
+    fields = ("parent_id", "value", "operations", "children_ids", "n_visits", "is_fixed")
+
     def __init__(self, node_id, parent_id=None, value=0, operations=None, children_ids=None, n_visits=0, is_fixed=False):
         self.node_id = node_id
         self.parent_id = parent_id
@@ -9,6 +12,12 @@ class MCTS_NODE():
         self.children_ids = children_ids or []
         self.n_visits = n_visits
         self.is_fixed = is_fixed
+        self.dirty = True
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in MCTS_NODE.fields:
+            object.__setattr__(self, 'dirty', True)
 
     def to_dict(self):
         return {
@@ -34,12 +43,15 @@ class MCTS_NODE():
         )
 
 class MCTS():
-    def __init__(self, nodes=None, optimal_node_id=None, node_id=0):
+    def __init__(self, nodes=None, optimal_node_id=None, node_id=0, loader=None):
         self.nodes = nodes or {}
         self.optimal_node_id = optimal_node_id
         self.node_id = node_id
+        # loader(node_ids) -> {node_id: MCTS_NODE}, node_ids None loads the whole tree
+        self.loader = loader
+        self.deleted_node_ids = []
 
-        if len(self.nodes) == 0:
+        if len(self.nodes) == 0 and loader is None:
             node = MCTS_NODE(node_id)
             node.value = 5
             self.nodes[node_id] = node
@@ -47,6 +59,7 @@ class MCTS():
             self.node_id += 1
 
     def to_dict(self):
+        self.load_all()
         return {
             "nodes": [node.to_dict() for node in self.nodes.values()],
             "optimal_node_id": self.optimal_node_id,
@@ -61,8 +74,27 @@ class MCTS():
             nodes[node.node_id] = node
         return MCTS(nodes=nodes, optimal_node_id=data["optimal_node_id"], node_id=data["node_id"])
 
+    def meta_dict(self):
+        return {"optimal_node_id": self.optimal_node_id, "node_id": self.node_id}
+
+    def load(self, node_ids):
+        missing = [id for id in node_ids if id not in self.nodes]
+        if len(missing) > 0 and self.loader is not None:
+            self.nodes.update(self.loader(missing))
+
+    def load_all(self):
+        if self.loader is not None:
+            for node_id, node in self.loader(None).items():
+                self.nodes.setdefault(node_id, node)
+            self.loader = None
+
+    def dirty_nodes(self):
+        # only loaded nodes can have changed
+        return [node for node in self.nodes.values() if node.dirty]
+
     
     def random_select(self):
+        self.load_all()
         if len(self.nodes) == 1:
             return self.nodes[0]
         else:
@@ -80,6 +112,7 @@ class MCTS():
             return selected_node
 
     def random_select_bsf(self):
+        self.load_all()
         if len(self.nodes) == 1 and not self.nodes[0].is_fixed:
             return self.nodes[0]
 
@@ -118,15 +151,17 @@ class MCTS():
         new_node = MCTS_NODE(self.node_id, parent_id=p_node.node_id, value=value, operations=operations)
         self.nodes[self.node_id] = new_node
         p_node.children_ids.append(new_node.node_id)
+        p_node.dirty = True
         self.node_id += 1
 
-        if value > self.nodes[self.optimal_node_id].value:
+        if value > self.get_node(self.optimal_node_id).value:
             self.optimal_node_id = new_node.node_id
 
         return new_node
 
     def get_children_operations(self, node):
         operations = []
+        self.load(node.children_ids)
         for id in node.children_ids:
             operation = self.nodes[id].operations[-1]
             operations.append(operation)
@@ -135,10 +170,8 @@ class MCTS():
     def get_node(self, node_id):
         if node_id == None:
             return None
-        for node in self.nodes.values():
-            if node.node_id == node_id:
-                return node
-        return None
+        self.load([node_id])
+        return self.nodes.get(node_id, None)
 
     def delete_node(self, node_id):
         # delete the node
@@ -153,8 +186,10 @@ class MCTS():
             parent_node = self.get_node(node.parent_id)
             if parent_node != None:
                 parent_node.children_ids.remove(node.node_id)
+                parent_node.dirty = True
         
         self.nodes.pop(node_id, None)
+        self.deleted_node_ids.append(node_id)
         return True
 
     # def insert(self, operations):
@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+from typing import List, Dict
+from .ImageHash import average_hash, hash_array, hamming_distances
+
+
+def make_object(image: np.ndarray, x0, y0, x1, y1, w, h, area_threshold, min_center_y):
+    """Crop and hash one candidate box, or None when it is filtered out."""
+    height, width = image.shape[:2]
+    area = w * h
+    if area / (height * width) > area_threshold or w <= 5 or h <= 5:
+        return None
+
+    center_x = (x0 + x1) // 2
+    center_y = (y0 + y1) // 2
+    if center_y < min_center_y:
+        return None
+
+    cropped = image[y0:y1, x0:x1]
+    resized = cv2.resize(cropped, (32, 32))
+    gray = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
+    if np.std(gray) < 10:
+        return None
+
+    return {
+        'id': None,
+        'bbox': [x0, y0, w, h],
+        'area': area,
+        'hash': average_hash(resized),
+        'center': (center_x, center_y),
+        'image': cropped
+    }
+
+
+def dedup_objects(objects: List[Dict], center_tol=6, hash_threshold=5) -> List[Dict]:
+    """
+    Keep-first dedup: an object is dropped when an already kept one has its centre
+    within center_tol px on both axes or its hash within hash_threshold bits.
+    Centres are bucketed in a grid of center_tol px cells, so only the 3x3
+    neighbourhood is scanned; each kept object marks the later hash near-duplicates
+    as suppressed, so hashes are only compared against kept ones.
+    """
+    n = len(objects)
+    if n == 0:
+        return []
+
+    hashes = hash_array([obj['hash'] for obj in objects])
+    suppressed = np.zeros(n, dtype=bool)
+    cell = max(1, center_tol)
+    grid = {}
+    kept = []
+    for i, obj in enumerate(objects):
+        if suppressed[i]:
+            continue
+
+        cx, cy = obj['center']
+        gx, gy = cx // cell, cy // cell
+        is_duplicate = False
+        for nx in (gx - 1, gx, gx + 1):
+            for ny in (gy - 1, gy, gy + 1):
+                for px, py in grid.get((nx, ny), ()):
+                    if abs(px - cx) <= center_tol and abs(py - cy) <= center_tol:
+                        is_duplicate = True
+                        break
+                if is_duplicate:
+                    break
+            if is_duplicate:
+                break
+        if is_duplicate:
+            continue
+
+        kept.append(obj)
+        grid.setdefault((gx, gy), []).append((cx, cy))
+        suppressed[i + 1:] |= hamming_distances(int(hashes[i]), hashes[i + 1:]) <= hash_threshold
+
+    return kept
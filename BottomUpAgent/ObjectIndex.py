@@ -0,0 +1,122 @@
+import math
+import itertools
+import numpy as np
+from .ImageHash import hamming_distances
+
+
+class ObjectIndex:
+    """
+    Multi-index hashing over 64-bit object hashes, partitioned by area.
+    Hashes are split into n_bands bands; two hashes within distance k agree on
+    at least one band up to k // n_bands bits, so a query only probes the band
+    values within that radius. Objects are bucketed by log(area) so that only
+    the neighbouring buckets can satisfy the relative area tolerance.
+    """
+    def __init__(self, hash_threshold=15, area_tol=0.1, n_bands=4, linear_threshold=16384, capacity=1024):
+        self.hash_threshold = hash_threshold
+        self.area_tol = area_tol
+        self.n_bands = n_bands
+        self.band_bits = 64 // n_bands
+        self.linear_threshold = linear_threshold
+        self.bucket_width = -math.log(1 - area_tol) if 0 < area_tol < 1 else 1.0
+
+        self.ids = []
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self._areas = np.empty(capacity, dtype=np.float64)
+        self.buckets = {}
+        self._tables = {}
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _bucket(self, area):
+        return int(math.floor(math.log(max(area, 1)) / self.bucket_width))
+
+    def add(self, id, hash_val, area):
+        row = len(self.ids)
+        if row == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.empty_like(self._hashes)])
+            self._areas = np.concatenate([self._areas, np.empty_like(self._areas)])
+        self.ids.append(id)
+        self._hashes[row] = int(hash_val)
+        self._areas[row] = area
+        bucket = self._bucket(area)
+        self.buckets.setdefault(bucket, []).append(row)
+        # re-sorted on the next query that probes this bucket
+        self._tables.pop(bucket, None)
+
+    def add_objects(self, objects):
+        for obj in objects:
+            self.add(obj['id'], obj['hash'], obj['area'])
+
+    def _bands(self, hashes):
+        mask = np.uint64((1 << self.band_bits) - 1)
+        return [(hashes >> np.uint64(band * self.band_bits)) & mask for band in range(self.n_bands)]
+
+    def _table(self, bucket):
+        # per band: sorted band values and the rows they belong to
+        if bucket not in self._tables:
+            rows = np.array(self.buckets[bucket], dtype=np.int64)
+            hashes = self._hashes[rows]
+            table = []
+            for values in self._bands(hashes):
+                order = np.argsort(values, kind='stable')
+                table.append((values[order], rows[order]))
+            self._tables[bucket] = table
+        return self._tables[bucket]
+
+    def _band_masks(self, radius):
+        # every band_bits-bit xor mask with at most `radius` set bits
+        if radius not in self._masks:
+            masks = [0]
+            for r in range(1, radius + 1):
+                for bits in itertools.combinations(range(self.band_bits), r):
+                    masks.append(sum(1 << bit for bit in bits))
+            self._masks[radius] = np.array(masks, dtype=np.uint64)
+        return self._masks[radius]
+
+    def _candidates(self, hash_val, area, max_distance):
+        if len(self.ids) <= self.linear_threshold:
+            return np.arange(len(self.ids))
+
+        masks = self._band_masks(max_distance // self.n_bands)
+        query_bands = self._bands(np.array([hash_val], dtype=np.uint64))
+        bucket = self._bucket(area)
+        rows = []
+        for b in (bucket - 1, bucket, bucket + 1):
+            if b not in self.buckets:
+                continue
+            for (values, band_rows), query_band in zip(self._table(b), query_bands):
+                probes = query_band ^ masks
+                left = np.searchsorted(values, probes, side='left')
+                counts = np.searchsorted(values, probes, side='right') - left
+                hit = counts > 0
+                if not np.any(hit):
+                    continue
+                # gather every [left, right) range without a python loop
+                left, counts = left[hit], counts[hit]
+                offsets = np.repeat(left - (np.cumsum(counts) - counts), counts)
+                rows.append(band_rows[offsets + np.arange(counts.sum())])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(rows))
+
+    def nearest(self, hash_val, area, max_distance=None):
+        """Return (id, distance) of the closest object within max_distance and area_tol, or (None, None)."""
+        if len(self.ids) == 0:
+            return None, None
+        max_distance = self.hash_threshold if max_distance is None else max_distance
+        rows = self._candidates(int(hash_val), area, max_distance)
+        if len(rows) == 0:
+            return None, None
+
+        areas = self._areas[rows]
+        distances = hamming_distances(int(hash_val), self._hashes[rows])
+        matched = (np.abs(area - areas) / areas <= self.area_tol) & (distances <= max_distance)
+        if not np.any(matched):
+            return None, None
+        rows, distances = rows[matched], distances[matched]
+        # rows are sorted, argmin keeps the earliest inserted object on ties
+        best = int(np.argmin(distances))
+        return self.ids[rows[best]], int(distances[best])
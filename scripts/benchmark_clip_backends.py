@@ -0,0 +1,54 @@
+import os
+import time
+import argparse
+import cv2
+import torch
+
+from BottomUpAgent.Detector import CLIP, OnnxCLIP
+
+
+def load_images(image_dir, max_images):
+    images = []
+    for name in sorted(os.listdir(image_dir))[:max_images]:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def bench(name, model, images, batch_size, repeat):
+    model.encode_images(images[:1])  # warm-up
+    time0 = time.time()
+    for _ in range(repeat):
+        for image in images:
+            model.encode_image(image)
+    single = (time.time() - time0) / (repeat * len(images))
+
+    time0 = time.time()
+    for _ in range(repeat):
+        model.encode_images(images, batch_size=batch_size)
+    batched = (time.time() - time0) / (repeat * len(images))
+    print(f"{name:>12} | {single * 1000:8.2f} ms/frame single | {batched * 1000:8.2f} ms/frame batch={batch_size}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clip_model', type=str, default='ViT-B/32')
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--max_images', type=int, default=16)
+    parser.add_argument('--onnx_dir', type=str, default='weights/clip_onnx')
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='torch / onnxruntime intra-op threads, 0 = library default')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    images = load_images(args.image_dir, args.max_images)
+    print(f"{len(images)} images, CPU")
+
+    bench('torch', CLIP(model_name=args.clip_model, use_gpu=False), images, args.batch_size, args.repeat)
+    bench('onnx', OnnxCLIP(model_name=args.clip_model, onnx_dir=args.onnx_dir, intra_op_threads=args.threads),
+          images, args.batch_size, args.repeat)
+    bench('onnx-int8', OnnxCLIP(model_name=args.clip_model, onnx_dir=args.onnx_dir, quantize=True, intra_op_threads=args.threads),
+          images, args.batch_size, args.repeat)
@@ -0,0 +1,92 @@
+import os
+import time
+import argparse
+import cv2
+import yaml
+
+from BottomUpAgent.ImageHash import hamming_distance
+from BottomUpAgent.ObjectDedup import make_object, dedup_objects
+
+
+def dedup_nested(objects, center_tol=6, hash_threshold=5):
+    # the previous per-extractor loop, kept as the reference
+    kept = []
+    for obj in objects:
+        is_duplicate = False
+        for prev_object in kept:
+            px, py = prev_object['center']
+            if abs(px - obj['center'][0]) <= center_tol and abs(py - obj['center'][1]) <= center_tol:
+                is_duplicate = True
+                break
+            if hamming_distance(prev_object['hash'], obj['hash']) <= hash_threshold:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            kept.append(obj)
+    return kept
+
+
+def contour_boxes(image):
+    # cheap stand-in for SAM masks: bounding boxes of edge contours at a few scales
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    boxes = []
+    for low, high in [(50, 150), (100, 200), (30, 100)]:
+        edges = cv2.Canny(gray, low, high)
+        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        boxes.extend(cv2.boundingRect(contour) for contour in contours)
+    return boxes
+
+
+def sam_boxes(config, image):
+    from BottomUpAgent.Detector import Detector
+    if not hasattr(sam_boxes, 'detector'):
+        sam_boxes.detector = Detector(config)
+    return [mask['bbox'] for mask in sam_boxes.detector.sam_session.generate(image)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--config_file', type=str, default=None, help='use SAM masks from this config instead of contour boxes')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    config = None
+    if args.config_file is not None:
+        with open(args.config_file, 'r') as f:
+            config = yaml.safe_load(f)
+
+    total_nested, total_grid, total_candidates = 0.0, 0.0, 0
+    for name in sorted(os.listdir(args.image_dir)):
+        image = cv2.imread(os.path.join(args.image_dir, name))
+        if image is None:
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        boxes = sam_boxes(config, image) if config is not None else contour_boxes(image)
+        candidates = []
+        for x, y, w, h in boxes:
+            obj = make_object(image, int(x), int(y), int(x + w), int(y + h), w, h, 0.03, min_center_y=25)
+            if obj is not None:
+                candidates.append(obj)
+
+        time0 = time.time()
+        for _ in range(args.repeat):
+            nested = dedup_nested(candidates)
+        nested_time = (time.time() - time0) / args.repeat
+
+        time0 = time.time()
+        for _ in range(args.repeat):
+            grid = dedup_objects(candidates)
+        grid_time = (time.time() - time0) / args.repeat
+
+        same = [id(obj) for obj in nested] == [id(obj) for obj in grid]
+        print(f"{name:>8} | {len(candidates):5d} candidates -> {len(grid):4d} kept | "
+              f"nested {nested_time * 1000:8.2f} ms | grid+suppress {grid_time * 1000:8.2f} ms | same result: {same}")
+        total_nested += nested_time
+        total_grid += grid_time
+        total_candidates += len(candidates)
+
+    if total_grid > 0:
+        print(f"total {total_candidates} candidates | nested {total_nested * 1000:.1f} ms | grid+suppress {total_grid * 1000:.1f} ms | "
+              f"speedup {total_nested / total_grid:.1f}x")
@@ -0,0 +1,88 @@
+import os
+import time
+import argparse
+import cv2
+import yaml
+import numpy as np
+import torch
+from segment_anything import sam_model_registry
+
+from BottomUpAgent.Detector import SAM_PROFILES, SamSession, sam_settings, sam_profile
+from BottomUpAgent.ObjectDedup import make_object, dedup_objects
+
+
+def box_iou(box, boxes):
+    # box: x, y, w, h; boxes: (n, 4) in the same layout
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[0] + box[2], boxes[:, 0] + boxes[:, 2])
+    y1 = np.minimum(box[1] + box[3], boxes[:, 1] + boxes[:, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    return inter / (box[2] * box[3] + boxes[:, 2] * boxes[:, 3] - inter)
+
+
+def recall(reference, objects, iou_threshold):
+    # share of reference objects with a detected box at IoU >= iou_threshold
+    if len(reference) == 0:
+        return 1.0
+    if len(objects) == 0:
+        return 0.0
+    boxes = np.array([obj['bbox'] for obj in objects], dtype=np.float64)
+    matched = sum(box_iou(np.array(obj['bbox'], dtype=np.float64), boxes).max() >= iou_threshold for obj in reference)
+    return matched / len(reference)
+
+
+def detect(session, image):
+    # same filtering and dedup as the sam backend of Detector
+    time0 = time.time()
+    masks = session.generate(image)
+    elapsed = time.time() - time0
+    candidates = []
+    for mask in masks:
+        x, y, w, h = mask['bbox']
+        obj = make_object(image, int(x), int(y), int(x + w), int(y + h), w, h, 0.03, min_center_y=25)
+        if obj is not None:
+            candidates.append(obj)
+    return dedup_objects(candidates), len(masks), elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', type=str, default='config/sts_explore_claude.yaml')
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--max_images', type=int, default=10)
+    parser.add_argument('--profiles', type=str, default=','.join(SAM_PROFILES.keys()))
+    parser.add_argument('--reference', type=str, default='default', help='profile whose objects count as ground truth')
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--iou', type=float, default=0.5)
+    args = parser.parse_args()
+
+    with open(args.config_file, 'r') as f:
+        config = yaml.safe_load(f)
+    detector_config = config['detector']
+    sam_config = sam_settings(detector_config)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    sam = sam_model_registry[sam_config['sam_type']](checkpoint=sam_config['sam_weights']).to(device)
+
+    images = []
+    for name in sorted(os.listdir(args.image_dir))[:args.max_images]:
+        image = cv2.imread(os.path.join(args.image_dir, name))
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    print(f"{len(images)} images on {device}, reference profile '{args.reference}'")
+
+    results = {}
+    for name in [args.reference] + [p for p in args.profiles.split(',') if p != args.reference]:
+        profile = sam_profile({'profile': name, 'num_threads': args.num_threads} if args.num_threads else {'profile': name})
+        session = SamSession(sam, profile)
+        results[name] = [detect(session, image) for image in images]
+
+    reference = results[args.reference]
+    print(f"{'profile':>10} | {'s/frame':>8} | {'masks/s':>8} | {'objects':>7} | recall@{args.iou}")
+    for name, runs in results.items():
+        total_time = sum(elapsed for _, _, elapsed in runs)
+        total_masks = sum(n_masks for _, n_masks, _ in runs)
+        n_objects = np.mean([len(objects) for objects, _, _ in runs])
+        r = np.mean([recall(ref[0], run[0], args.iou) for ref, run in zip(reference, runs)])
+        print(f"{name:>10} | {total_time / len(runs):8.2f} | {total_masks / total_time:8.1f} | {n_objects:7.1f} | {r:.3f}")
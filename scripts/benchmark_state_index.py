@@ -0,0 +1,56 @@
+import time
+import argparse
+import numpy as np
+
+from BottomUpAgent.FeatureIndex import ExactIndex, IVFIndex, HNSWIndex, normalize_features, hnswlib
+
+
+def make_features(n, dim, n_clusters, rng):
+    # CLIP screen features of one game form tight clusters (menus, map, combat, ...)
+    centers = normalize_features(rng.standard_normal((n_clusters, dim)))
+    labels = rng.integers(0, n_clusters, size=n)
+    return normalize_features(centers[labels] + 0.5 * rng.standard_normal((n, dim)) / np.sqrt(dim))
+
+
+def bench(name, index, ids, feats, queries, truth):
+    time0 = time.time()
+    index.add_batch(ids, feats)
+    build_time = time.time() - time0
+
+    hits = 0
+    time0 = time.time()
+    for query, true_id in zip(queries, truth):
+        best_id, _ = index.search(query)
+        hits += int(best_id == true_id)
+    elapsed = time.time() - time0
+
+    print(f"{name:>6} | build {build_time:7.2f}s | {elapsed / len(queries) * 1000:8.3f} ms/query | recall@1 {hits / len(queries):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num', type=int, default=100000, help='number of stored states')
+    parser.add_argument('--dim', type=int, default=512, help='feature dim (ViT-B/32 is 512)')
+    parser.add_argument('--clusters', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nprobe', type=int, default=16)
+    opt = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    feats = make_features(opt.num, opt.dim, opt.clusters, rng)
+    ids = np.arange(1, opt.num + 1)
+
+    # queries are noisy re-captures of stored states
+    picks = rng.integers(0, opt.num, size=opt.queries)
+    queries = normalize_features(feats[picks] + 0.05 * rng.standard_normal((opt.queries, opt.dim)) / np.sqrt(opt.dim))
+
+    exact = ExactIndex()
+    exact.add_batch(ids, feats)
+    truth = [exact.search(query)[0] for query in queries]
+
+    bench('exact', ExactIndex(), ids, feats, queries, truth)
+    bench('ivf', IVFIndex(nprobe=opt.nprobe), ids, feats, queries, truth)
+    if hnswlib is not None:
+        bench('hnsw', HNSWIndex(), ids, feats, queries, truth)
+    else:
+        print("hnswlib not installed, skip hnsw")
@@ -0,0 +1,67 @@
+import os
+import time
+import argparse
+import cv2
+import yaml
+import numpy as np
+
+from BottomUpAgent.Detector import Detector
+from BottomUpAgent.DetectorBackends import DETECTOR_BACKENDS
+from BottomUpAgent.ObjectDedup import dedup_objects
+from scripts.benchmark_sam_profiles import recall
+
+
+def load_images(image_dir, max_images):
+    images = []
+    for name in sorted(os.listdir(image_dir))[:max_images]:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def detect(detector, backend, image):
+    # shared post-filters and dedup, as in Detector.detect_objects without the fallback
+    time0 = time.time()
+    objects = dedup_objects(backend.candidates(image, None, detector.area_threshold))
+    return objects, time.time() - time0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', type=str, default='config/sts_explore_claude.yaml')
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--max_images', type=int, default=10)
+    parser.add_argument('--backends', type=str, default='cv,sam')
+    parser.add_argument('--reference', type=str, default='sam', help='backend whose objects count as ground truth')
+    parser.add_argument('--min_objects', type=int, default=5, help='fallback threshold to report')
+    parser.add_argument('--iou', type=float, default=0.5)
+    args = parser.parse_args()
+
+    with open(args.config_file, 'r') as f:
+        config = yaml.safe_load(f)
+    # measure the backends themselves, not the caches in front of them
+    config['detector']['cache'] = {'enabled': False}
+    config['detector']['embedding_cache'] = {'enabled': False}
+    config['detector']['debug_sink'] = {'mode': 'off'}
+    detector = Detector(config)
+
+    images = load_images(args.image_dir, args.max_images)
+    names = [args.reference] + [name for name in args.backends.split(',') if name != args.reference]
+    print(f"{len(images)} images, backends {', '.join(DETECTOR_BACKENDS)}, reference '{args.reference}'")
+
+    results = {}
+    for name in names:
+        backend = detector.create_backend(name)
+        for model in backend.models:
+            detector.models[model].get()  # keep model loading out of the timings
+        results[name] = [detect(detector, backend, image) for image in images]
+
+    reference = results[args.reference]
+    print(f"{'backend':>8} | {'ms/frame':>8} | {'objects':>7} | {'<min':>5} | recall@{args.iou}")
+    for name, runs in results.items():
+        ms = np.mean([elapsed for _, elapsed in runs]) * 1000
+        n_objects = np.mean([len(objects) for objects, _ in runs])
+        few = sum(len(objects) < args.min_objects for objects, _ in runs)
+        r = np.mean([recall(ref[0], run[0], args.iou) for ref, run in zip(reference, runs)])
+        print(f"{name:>8} | {ms:8.1f} | {n_objects:7.1f} | {few:5d} | {r:.3f}")
@@ -0,0 +1,22 @@
+from BottomUpAgent.LongMemory import LongMemory
+import yaml
+import argparse
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', required=True, help='path to the config file')
+    parser.add_argument('--batch_size', type=int, default=500, help='rows converted per transaction')
+    parser.add_argument('--vacuum', action='store_true', help='shrink the db file after moving images out')
+
+    opt = parser.parse_args()
+
+    with open(opt.config_file, "r") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    memory = LongMemory(config)
+    memory.migrate(batch_size=opt.batch_size)
+    if opt.vacuum:
+        memory.vacuum()
+    memory.close()
+    print(f"Migrated {config['game_name']}.db")
@@ -0,0 +1,52 @@
+import os
+import sys
+import argparse
+import cv2
+import numpy as np
+
+from BottomUpAgent.Detector import CLIP, OnnxCLIP
+
+
+def load_images(image_dir, max_images):
+    images = []
+    for name in sorted(os.listdir(image_dir))[:max_images]:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def test_parity(torch_clip, onnx_clip, images, texts, min_cos):
+    # both paths return L2-normalised rows, so the row-wise dot product is the cosine similarity
+    image_cos = np.sum(torch_clip.encode_images(images) * onnx_clip.encode_images(images), axis=1)
+    text_cos = np.sum(torch_clip.encode_texts(texts) * onnx_clip.encode_texts(texts), axis=1)
+    print(f"image cosine: min {image_cos.min():.5f} mean {image_cos.mean():.5f}")
+    print(f"text cosine:  min {text_cos.min():.5f} mean {text_cos.mean():.5f}")
+
+    # the ranking of states must not change either
+    torch_sims = torch_clip.encode_images(images) @ torch_clip.encode_images(images).T
+    onnx_sims = onnx_clip.encode_images(images) @ onnx_clip.encode_images(images).T
+    print(f"max |state similarity difference|: {np.abs(torch_sims - onnx_sims).max():.5f}")
+    return image_cos.min() >= min_cos and text_cos.min() >= min_cos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clip_model', type=str, default='ViT-B/32')
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--max_images', type=int, default=16)
+    parser.add_argument('--onnx_dir', type=str, default='weights/clip_onnx')
+    parser.add_argument('--quantize', action='store_true')
+    parser.add_argument('--min_cos', type=float, default=None, help='defaults to 0.999, or 0.98 with --quantize')
+    args = parser.parse_args()
+
+    min_cos = args.min_cos if args.min_cos is not None else (0.98 if args.quantize else 0.999)
+    torch_clip = CLIP(model_name=args.clip_model, use_gpu=False)
+    onnx_clip = OnnxCLIP(model_name=args.clip_model, onnx_dir=args.onnx_dir, quantize=args.quantize)
+    texts = ["End Turn", "Play a card", "Open the map", "Select the first card in hand", "Confirm"]
+
+    if test_parity(torch_clip, onnx_clip, load_images(args.image_dir, args.max_images), texts, min_cos):
+        print(f"PASS: cosine similarity >= {min_cos}")
+    else:
+        print(f"FAIL: cosine similarity < {min_cos}")
+        sys.exit(1)
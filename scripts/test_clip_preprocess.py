@@ -0,0 +1,53 @@
+import os
+import sys
+import argparse
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from BottomUpAgent.Detector import CLIP
+
+
+def load_images(image_dir, max_images):
+    images = []
+    for name in sorted(os.listdir(image_dir))[:max_images]:
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is not None:
+            images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return images
+
+
+def encode_pil(model, images):
+    # the path stored state features were computed with: clip's own PIL/torchvision preprocess
+    with torch.no_grad():
+        batch = torch.stack([model.preprocess(Image.fromarray(image)) for image in images]).to(model.device)
+        features = model.model.encode_image(batch)
+        features = features / features.norm(dim=-1, keepdim=True)
+    return features.float().cpu().numpy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clip_model', type=str, default='ViT-B/32')
+    parser.add_argument('--image_dir', type=str, default='scripts/images')
+    parser.add_argument('--max_images', type=int, default=16)
+    parser.add_argument('--min_cos', type=float, default=0.999)
+    args = parser.parse_args()
+
+    model = CLIP(model_name=args.clip_model, use_gpu=False)
+    images = load_images(args.image_dir, args.max_images)
+    # full screenshots (downscaled) and object-sized crops (upscaled)
+    crops = [image[100:160, 200:300] for image in images]
+
+    passed = True
+    for name, batch in [('screenshots', images), ('crops', crops)]:
+        cos = np.sum(model.encode_images(batch) * encode_pil(model, batch), axis=1)
+        print(f"{name}: cosine min {cos.min():.5f} mean {cos.mean():.5f}")
+        passed = passed and cos.min() >= args.min_cos
+
+    if passed:
+        print(f"PASS: cosine similarity >= {args.min_cos}")
+    else:
+        print(f"FAIL: cosine similarity < {args.min_cos}")
+        sys.exit(1)
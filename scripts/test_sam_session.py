@@ -0,0 +1,45 @@
+import sys
+import time
+import argparse
+import cv2
+import yaml
+import torch
+from segment_anything import sam_model_registry
+
+from BottomUpAgent.Detector import SamSession, sam_settings, sam_profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config_file', type=str, default='config/sts_explore_claude.yaml')
+    parser.add_argument('--image', type=str, default='scripts/images/1.jpg')
+    parser.add_argument('--points', type=int, default=5, help='point prompts at the centres of the largest masks')
+    args = parser.parse_args()
+
+    with open(args.config_file, 'r') as f:
+        config = yaml.safe_load(f)
+    detector_config = config['detector']
+    sam_config = sam_settings(detector_config)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    sam = sam_model_registry[sam_config['sam_type']](checkpoint=sam_config['sam_weights']).to(device)
+    session = SamSession(sam, sam_profile(sam_config))
+    image = cv2.cvtColor(cv2.imread(args.image), cv2.COLOR_BGR2RGB)
+
+    time0 = time.time()
+    masks = session.generate(image)
+    print(f"automatic masks: {len(masks)} in {time.time() - time0:.2f}s")
+
+    # every prompt must reuse the embedding computed by generate
+    masks = sorted(masks, key=lambda mask: mask['area'], reverse=True)[:args.points]
+    for mask in masks:
+        x, y, w, h = mask['bbox']
+        time0 = time.time()
+        result = session.segment_point(image, x + w / 2, y + h / 2)
+        print(f"point ({x + w / 2:.0f}, {y + h / 2:.0f}): bbox {result['bbox']} score {result['score']:.3f} "
+              f"in {(time.time() - time0) * 1000:.1f}ms")
+
+    stats = session.stats()
+    print(f"embedding cache: {stats['hits']} hits, {stats['misses']} misses")
+    # one encoder run for generate (crop_n_layers 0), none for the prompts
+    sys.exit(0 if stats['misses'] == 1 and stats['hits'] == len(masks) else 1)
@@ -21,4 +21,6 @@ if __name__ == "__main__":
     object_image = cv2.cvtColor(object_image, cv2.COLOR_BGR2RGB)
 
     memory.update_object(opt.object_id, object_image)
+    # drains the write-behind queue before the writer thread dies with the interpreter
+    memory.close()
     print(f"Updated object {opt.object_id} with new image.")
\ No newline at end of file